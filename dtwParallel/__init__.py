@@ -0,0 +1 @@
+"""dtwParallel: parallel Dynamic Time Warping for univariate and multivariate time series."""
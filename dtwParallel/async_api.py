@@ -0,0 +1,212 @@
+import asyncio
+import sys
+import os.path
+import weakref
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from dtw_functions import dtw, warm_up, LOCAL_DISSIMILARITY_CODE
+
+# Asyncio counterparts of dtw(): the computation is offloaded to an executor so the event
+# loop keeps serving other requests while it runs.
+#
+#     distance = await adtw(x, y, local_dissimilarity="norm2")
+#     matrix = await adtw_matrix(X, Y, MTS=True, local_dissimilarity="norm2")
+#
+# Compiled local dissimilarities (norm1, norm2, square_euclidean_distance) run in a
+# GIL-free kernel, so they go to a thread pool; the rest (scipy distances, gower) hold the
+# GIL and go to a process pool. Cancelling the awaiting task drops the work that has not
+# started yet; a pair that is already being computed finishes in the background.
+
+
+def _dtw_pairs(pairs, options):
+    return [dtw(ts1, ts2, **options) for ts1, ts2 in pairs]
+
+
+def _dtw_rows(rows, Y, options):
+    return [[dtw(ts1, ts2, **options) for ts2 in Y] for ts1 in rows]
+
+
+def _options_key(options):
+    key = tuple(sorted(options.items()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class _MicroBatcher:
+    """
+    Groups the small pairs requested concurrently with the same options into a single
+    executor call, which saves the per-call dispatch cost (a process round trip or a
+    thread hand-off) that dominates for short series.
+    """
+    def __init__(self, engine, options):
+        self.engine = engine
+        self.options = options
+        self.pending = []
+        self.timer = None
+        # The event loop only keeps weak references to tasks.
+        self.tasks = set()
+
+    def add(self, ts1, ts2):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((ts1, ts2, future))
+        if len(self.pending) >= self.engine.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.engine.batch_delay, self.flush)
+        return future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch = [job for job in self.pending if not job[2].cancelled()]
+        self.pending = []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(lambda task: self._done(task, batch))
+
+    def _done(self, task, batch):
+        # A cancelled run (even one cancelled before it started, whose body never ran)
+        # cancels the pairs of its batch.
+        self.tasks.discard(task)
+        for _, _, future in batch:
+            if not future.done():
+                future.cancel()
+
+    async def _run(self, batch):
+        try:
+            distances = await self.engine._submit(_dtw_pairs, ([(ts1, ts2) for ts1, ts2, _ in batch],), self.options)
+        except Exception as error:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, _, future), distance in zip(batch, distances):
+            if not future.done():
+                future.set_result(distance)
+
+
+class AsyncDTW:
+    """
+    Executors, concurrency limit and micro-batching shared by the asyncio API.
+
+    Parameters
+    ------------
+    :param max_workers: size of the thread and process pools (None: executor default)
+    :param max_concurrency: maximum number of executor calls in flight (None: no limit)
+    :param batch_size: maximum number of small pairs grouped in one executor call
+    :param batch_delay: seconds a small pair waits for others to join its batch
+    :param small_size: pairs with at most len(ts1) * len(ts2) cells are batched
+    """
+    def __init__(self, max_workers=None, max_concurrency=None, batch_size=64, batch_delay=0.002, small_size=10000):
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.small_size = small_size
+        self._threads = None
+        self._processes = None
+        # Semaphores and batchers belong to one event loop.
+        self._loop_state = weakref.WeakKeyDictionary()
+
+    def _state(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._loop_state:
+            semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+            self._loop_state[loop] = (semaphore, {})
+        return self._loop_state[loop]
+
+    def _executor(self, options):
+        if options.get('local_dissimilarity') in LOCAL_DISSIMILARITY_CODE and not options.get('get_visualization'):
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.max_workers, initializer=warm_up)
+            return self._threads
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                  mp_context=mp.get_context('spawn'),
+                                                  initializer=warm_up)
+        return self._processes
+
+    async def _submit(self, func, args, options):
+        semaphore, _ = self._state()
+        executor = self._executor(options)
+        if semaphore is None:
+            return await asyncio.wrap_future(executor.submit(func, *args, options))
+        async with semaphore:
+            return await asyncio.wrap_future(executor.submit(func, *args, options))
+
+    async def dtw(self, ts1, ts2, **options):
+        """
+        Asynchronous dtw(ts1, ts2, **options) for a pair of time series.
+        """
+        key = _options_key(options)
+        if key is not None and np.size(ts1) * np.size(ts2) <= self.small_size:
+            _, batchers = self._state()
+            batcher = batchers.get(key)
+            if batcher is None:
+                batcher = batchers[key] = _MicroBatcher(self, options)
+            return await batcher.add(ts1, ts2)
+        distances = await self._submit(_dtw_pairs, ([(ts1, ts2)],), options)
+        return distances[0]
+
+    async def dtw_matrix(self, X, Y=None, chunk_size=None, **options):
+        """
+        Asynchronous distance matrix between the series of X and those of Y (X if None).
+        Rows are computed in chunks of chunk_size, so several chunks run at once and
+        cancelling the call drops the chunks that have not started.
+
+        :return: numpy.ndarray of shape (len(X), len(Y))
+        """
+        Y = X if Y is None else Y
+        if chunk_size is None:
+            chunk_size = max(1, len(X) // (4 * (self.max_workers or os.cpu_count() or 1)))
+        tasks = [asyncio.ensure_future(self._submit(_dtw_rows, (X[start:start + chunk_size], Y), options))
+                 for start in range(0, len(X), chunk_size)]
+        try:
+            rows = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return np.array([row for chunk in rows for row in chunk], dtype=float).reshape(len(X), len(Y))
+
+    def close(self, wait=True):
+        for executor in (self._threads, self._processes):
+            if executor is not None:
+                executor.shutdown(wait=wait, cancel_futures=True)
+        self._threads = None
+        self._processes = None
+
+
+_default_engine = None
+
+
+def get_default_engine():
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = AsyncDTW()
+    return _default_engine
+
+
+async def adtw(ts1, ts2, **options):
+    """
+    Asynchronous counterpart of dtw(ts1, ts2, **options) using the default engine.
+    """
+    return await get_default_engine().dtw(ts1, ts2, **options)
+
+
+async def adtw_matrix(X, Y=None, **options):
+    """
+    Asynchronous distance matrix between X and Y (X if None) using the default engine.
+    """
+    return await get_default_engine().dtw_matrix(X, Y, **options)
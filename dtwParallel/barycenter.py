@@ -0,0 +1,144 @@
+import sys
+import os.path
+
+import numpy as np
+from joblib import Parallel, delayed
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from dtw_functions import dtw
+from ragged import RaggedTensor, as_ragged
+from warping_path import dtw_paths
+
+# DTW Barycenter Averaging (DBA, Petitjean et al., 2011). Starting from an initial
+# series, every iteration aligns all the series to the current barycenter with the
+# optimal warping path (computed in parallel by dtw_paths) and replaces each time step of
+# the barycenter by the mean of the time steps aligned to it. Iterations stop when the
+# relative decrease of the sum of the DTW distances to the barycenter is below tol.
+#
+# The mean is the optimal update for the squared Euclidean local cost, which is the
+# default local dissimilarity: with it the sum does not increase. With norm1, norm2 or a
+# constraint it may; an update that increases it is discarded and the previous
+# barycenter is returned.
+
+INIT_SAMPLE = 20
+
+
+def _medoid(series, options, n_threads, seed):
+    """
+    Series of a random sample of at most INIT_SAMPLE series with the smallest sum of
+    DTW distances to the rest of the sample.
+    """
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(series), size=min(len(series), INIT_SAMPLE), replace=False)
+    distances = Parallel(n_jobs=n_threads)(
+        delayed(dtw)(series[i], series[j], MTS=True, **options) for i in sample for j in sample
+    )
+    distances = np.array(distances, dtype=float).reshape(len(sample), len(sample))
+    return np.array(series[sample[np.argmin(distances.sum(axis=1))]], dtype=float)
+
+
+def _dba_update(barycenter, series, weights, options, n_threads, dtype):
+    """
+    One DBA iteration for a barycenter (T x F) and series of the same number of features.
+
+    :return: (numpy.ndarray, float)
+        New barycenter and weighted sum of the DTW distances to the current one.
+    """
+    alignments = dtw_paths([barycenter], series, pairs=np.column_stack((np.zeros(len(series), dtype=np.int64),
+                                                                        np.arange(len(series)))),
+                           n_threads=n_threads, dtype=dtype, **options)
+    pair = np.repeat(np.arange(len(alignments)), np.diff(alignments.offsets))
+    steps = alignments.indices[:, 0]
+    rows = series.offsets[pair] + alignments.indices[:, 1]
+
+    counts = np.bincount(steps, weights=weights[pair], minlength=len(barycenter))
+    sums = np.column_stack([np.bincount(steps, weights=weights[pair] * series.values[rows, f], minlength=len(barycenter))
+                            for f in range(series.n_features)])
+    updated = np.where(counts[:, np.newaxis] > 0, sums / np.maximum(counts, 1e-300)[:, np.newaxis], barycenter)
+    return updated, float(np.dot(weights, alignments.distances))
+
+
+def dtw_barycenter(X, init=None, weights=None, type_dtw="d", local_dissimilarity="square_euclidean_distance",
+                   constrained_path_search=None, sakoe_chiba_radius=None, itakura_max_slope=None,
+                   max_iterations=30, tol=1e-5, n_threads=-1, dtype="float64", seed=0, return_inertia=False):
+    """
+    DTW barycenter (DBA) of a set of time series.
+
+    Parameters
+    ------------
+    :param X: tensor of N MTS (N x T x F), RaggedTensor or list of series (T_i) or (T_i x F)
+    :param init: initial barycenter (default: medoid of a sample of the series)
+    :param weights: weight of each series (default: 1)
+    :param type_dtw: "d" (dependent: one path for all the features) or "i" (independent:
+        one barycenter per feature)
+    :param local_dissimilarity: "norm1", "norm2" or "square_euclidean_distance"
+    :param constrained_path_search: type constraint (None, sakoe-chiba o itakura)
+    :param sakoe_chiba_radius: int or None
+    :param itakura_max_slope: float or None
+    :param max_iterations: maximum number of updates of the barycenter
+    :param tol: stop when the sum of distances decreases by less than tol (relative)
+    :param n_threads: number of processes used to align the series
+    :param dtype: "float64" or "float32"
+    :param seed: seed of the sample used for the default initialization
+    :param return_inertia: also return the inertia: weighted sum of the DTW distances of
+        the series to the returned barycenter
+
+    :return: numpy.ndarray (T x F), and the inertia if return_inertia
+    """
+    series = as_ragged(X)
+    if len(series) == 0:
+        raise ValueError('The set of series is empty.')
+    options = dict(local_dissimilarity=local_dissimilarity, constrained_path_search=constrained_path_search,
+                   sakoe_chiba_radius=sakoe_chiba_radius, itakura_max_slope=itakura_max_slope)
+    weights = np.ones(len(series)) if weights is None else np.asarray(weights, dtype=float)
+
+    if init is None:
+        init = _medoid(series, dict(options, type_dtw=type_dtw), n_threads, seed)
+    barycenter = np.array(init, dtype=float)
+    if barycenter.ndim == 1:
+        barycenter = barycenter[:, np.newaxis]
+
+    # Independent DTW: each feature is averaged with its own alignments.
+    if type_dtw == "i":
+        features = [RaggedTensor(series.values[:, [f]], series.offsets) for f in range(series.n_features)]
+    else:
+        features = [series]
+
+    # Each alignment measures the cost of the current barycenter, so the one returned is
+    # always the last one aligned, with its own inertia.
+    previous, inertia = None, np.inf
+    for iteration in range(max_iterations + 1):
+        updates = [_dba_update(barycenter[:, [f]] if type_dtw == "i" else barycenter, feature, weights,
+                               options, n_threads, dtype)
+                   for f, feature in enumerate(features)]
+        current = sum(cost for _, cost in updates)
+        if current > inertia:
+            barycenter = previous
+            break
+        converged = inertia - current <= tol * current
+        previous, inertia = barycenter, current
+        if converged or iteration == max_iterations:
+            break
+        barycenter = np.hstack([update for update, _ in updates])
+
+    if return_inertia:
+        return barycenter, inertia
+    return barycenter
+
+
+def cluster_barycenters(X, labels, **kwargs):
+    """
+    DBA barycenter of the series of each cluster.
+
+    :param X: tensor, RaggedTensor or list of series
+    :param labels: cluster of each series
+    :param kwargs: parameters of dtw_barycenter
+
+    :return: dict
+        Barycenter of each label
+    """
+    series = as_ragged(X)
+    labels = np.asarray(labels)
+    return {label: dtw_barycenter([series[i] for i in np.flatnonzero(labels == label)], **kwargs)
+            for label in np.unique(labels)}
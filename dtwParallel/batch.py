@@ -0,0 +1,129 @@
+import json
+import sys
+import os.path
+
+import numpy as np
+from joblib import Parallel, delayed
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from dtw_functions import dtw, warm_up
+
+# Batch mode: many pair queries answered by one process. Each job is a line of the
+# input stream, either a JSON object
+#     {"id": "a-b", "x": [1, 2, 3], "y": "series_b.npy"}
+# where x and y are inline series (list or list of lists) or paths to .npy/.csv files,
+# or a CSV line "x_path,y_path[,id]". Results are written as JSON lines in completion order.
+
+
+def load_series(value):
+    """
+    Load one time series of a batch job.
+
+    Parameters
+    ------------
+    :param value: list (UTS), list of lists (MTS, one row per time step) or path to a .npy/.csv file
+
+    :return: numpy.ndarray
+        1D array for univariate series, 2D array (time x variables) for multivariate series.
+    """
+    if isinstance(value, str):
+        if value.endswith('.npy'):
+            series = np.load(value)
+        else:
+            series = np.loadtxt(value, delimiter=';', ndmin=1)
+    else:
+        series = np.asarray(value, dtype=float)
+
+    if series.ndim == 2 and series.shape[1] == 1:
+        series = series[:, 0]
+    return series
+
+
+def parse_job(line, line_number):
+    """
+    Parse one line of the batch input into (job_id, x, y) specifications.
+    """
+    line = line.strip()
+    if line.startswith('{'):
+        job = json.loads(line)
+        return job.get('id', line_number), job['x'], job['y']
+
+    fields = [field.strip() for field in line.split(',')]
+    if len(fields) < 2:
+        raise ValueError('Expected "x_path,y_path[,id]".')
+    job_id = fields[2] if len(fields) > 2 else line_number
+    return job_id, fields[0], fields[1]
+
+
+def run_job(job_id, x, y, options):
+    """
+    Compute the DTW distance of one batch job. Errors are reported in the result instead
+    of aborting the whole batch.
+    """
+    try:
+        ts1 = load_series(x)
+        ts2 = load_series(y)
+        mts = ts1.ndim > 1
+        distance = dtw(ts1, ts2, MTS=mts, **options)
+        return {'id': job_id, 'distance': float(distance)}
+    except Exception as error:
+        return {'id': job_id, 'error': '{}: {}'.format(type(error).__name__, error)}
+
+
+def iter_jobs(stream, options):
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        try:
+            job_id, x, y = parse_job(line, line_number)
+        except Exception as error:
+            yield delayed(_invalid_job)(line_number, error)
+            continue
+        yield delayed(run_job)(job_id, x, y, options)
+
+
+def _invalid_job(line_number, error):
+    return {'id': line_number, 'error': '{}: {}'.format(type(error).__name__, error)}
+
+
+def batch_options(input_obj):
+    """
+    DTW parameters shared by every job of the batch, taken from the parsed input object.
+    """
+    return {
+        'type_dtw': input_obj.type_dtw,
+        'constrained_path_search': input_obj.constrained_path_search,
+        'local_dissimilarity': input_obj.local_dissimilarity,
+        'regular_flag': input_obj.regular_flag,
+        'itakura_max_slope': input_obj.itakura_max_slope,
+        'sakoe_chiba_radius': input_obj.sakoe_chiba_radius,
+        'dtype': input_obj.dtype,
+    }
+
+
+def run_batch(stream, input_obj, output=sys.stdout):
+    """
+    Answer every job of `stream` with a single worker pool and write one JSON line per
+    result as soon as it is available.
+
+    Parameters
+    ------------
+    :param stream: iterable of lines (file object or sys.stdin)
+    :param input_obj: object with parameters
+    :param output: writable text stream
+
+    :return: int
+        Number of jobs that failed.
+    """
+    # Compile (or load from the numba cache) once before the workers start, so that
+    # none of them pays the JIT cost on its first job.
+    warm_up()
+
+    failed = 0
+    parallel = Parallel(n_jobs=input_obj.n_threads, return_as='generator_unordered')
+    for result in parallel(iter_jobs(stream, batch_options(input_obj))):
+        failed += 'error' in result
+        output.write(json.dumps(result) + '\n')
+        output.flush()
+    return failed
@@ -0,0 +1,272 @@
+import sys
+import os.path
+from collections import OrderedDict
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.spatial.distance import squareform
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from dtw_functions import _dtw_chunk
+from ragged import as_ragged
+from scheduling import CHUNKS_PER_WORKER, balanced_chunks, paired_costs
+
+# Clustering of large sets of series without the N x N DTW matrix. The algorithms ask a
+# DistanceCache for the distances they need (a sample against itself, every series
+# against the current medoids); the missing ones are computed in parallel, in chunks of
+# similar cost (scheduling.py), and kept by columns so that the distances to a medoid
+# are computed once.
+#
+#   - k_medoids, method="clara": PAM on several random samples of 40 + 2k series, each
+#     result scored on the whole set (Kaufman & Rousseeuw, 1990). About
+#     n_samples * (sample_size**2 / 2 + N * k) distances.
+#   - k_medoids, method="clarans": randomized search of medoid swaps, each one scored
+#     on the whole set (Ng & Han, 2002). About N distances per swap tried.
+#   - hierarchical_clustering: linkage of n_prototypes CLARA medoids, and each series
+#     in the cluster of its medoid. About n_prototypes**2 / 2 + N * n_prototypes distances.
+#
+# DTW is taken as symmetric: d(i, j) is computed once for both orders.
+
+CACHE_COLUMNS = 256
+CLARANS_NEIGHBORS = 250
+HIERARCHICAL_PROTOTYPES = 256
+
+
+class DistanceCache:
+    """
+    DTW distances between the series of a set, computed on demand. The distances are
+    stored by columns (distances of every series to series j); at most max_columns are
+    kept, the least recently used are dropped first.
+    """
+    def __init__(self, X, type_dtw="d", local_dissimilarity="norm2", constrained_path_search=None,
+                 sakoe_chiba_radius=None, itakura_max_slope=None, n_threads=-1, dtype="float64",
+                 max_columns=CACHE_COLUMNS):
+        self.series = as_ragged(X)
+        self.options = dict(type_dtw=type_dtw, local_dissimilarity=local_dissimilarity,
+                            constrained_path_search=constrained_path_search, sakoe_chiba_radius=sakoe_chiba_radius,
+                            itakura_max_slope=itakura_max_slope, MTS=True, dtype=dtype)
+        self.n_threads = n_threads
+        self.dtype = dtype
+        self.max_columns = max_columns
+        self.columns = OrderedDict()
+        self.n_computed = 0
+
+    def __len__(self):
+        return len(self.series)
+
+    def _column(self, j):
+        if j not in self.columns:
+            self.columns[j] = np.full(len(self), np.nan, dtype=self.dtype)
+            while len(self.columns) > self.max_columns:
+                self.columns.popitem(last=False)
+        self.columns.move_to_end(j)
+        return self.columns[j]
+
+    def _compute(self, pairs):
+        lengths = self.series.lengths
+        costs = paired_costs(lengths[pairs[:, 0]], lengths[pairs[:, 1]], self.options["constrained_path_search"],
+                             self.options["sakoe_chiba_radius"], self.options["itakura_max_slope"])
+        chunks = balanced_chunks(costs, CHUNKS_PER_WORKER * effective_n_jobs(self.n_threads))
+        results = Parallel(n_jobs=self.n_threads, batch_size=1)(
+            delayed(_dtw_chunk)([(self.series[i], self.series[j], None) for i, j in pairs[chunk]], self.options)
+            for chunk, _ in chunks
+        )
+
+        distances = np.empty(len(pairs), dtype=self.dtype)
+        for (chunk, _), chunk_distances in zip(chunks, results):
+            distances[chunk] = chunk_distances
+        self.n_computed += len(pairs)
+        return distances
+
+    def pairwise(self, rows, cols):
+        """
+        DTW distances between the series rows and the series cols.
+
+        :return: numpy.ndarray (len(rows) x len(cols))
+        """
+        rows = np.asarray(rows, dtype=np.int64).ravel()
+        cols = np.asarray(cols, dtype=np.int64).ravel()
+        out = np.full((len(rows), len(cols)), np.nan, dtype=self.dtype)
+        for c, j in enumerate(cols):
+            if j in self.columns:
+                out[:, c] = self._column(j)[rows]
+        for r, i in enumerate(rows):
+            if i in self.columns:
+                out[r] = np.where(np.isnan(out[r]), self.columns[i][cols], out[r])
+        out[rows[:, np.newaxis] == cols[np.newaxis, :]] = 0.
+
+        missing_r, missing_c = np.nonzero(np.isnan(out))
+        if len(missing_r):
+            # Each unordered pair is computed once.
+            first = np.minimum(rows[missing_r], cols[missing_c])
+            second = np.maximum(rows[missing_r], cols[missing_c])
+            pairs, inverse = np.unique(np.column_stack((first, second)), axis=0, return_inverse=True)
+            out[missing_r, missing_c] = self._compute(pairs)[inverse.ravel()]
+            for c in np.unique(missing_c):
+                column = self._column(cols[c])
+                column[rows] = out[:, c]
+        return out
+
+
+def _distance_cache(X, cache_options):
+    if isinstance(X, DistanceCache):
+        return X
+    return DistanceCache(X, **cache_options)
+
+
+def _pam(distances, n_clusters, max_iterations=100):
+    """
+    PAM (BUILD and SWAP) on a full distance matrix.
+
+    :return: (numpy.ndarray, float)
+        Indices of the medoids and sum of the distances to the nearest medoid.
+    """
+    medoids = [int(np.argmin(distances.sum(axis=0)))]
+    nearest = distances[:, medoids[0]].copy()
+    for _ in range(1, n_clusters):
+        gains = np.maximum(nearest[:, np.newaxis] - distances, 0).sum(axis=0)
+        gains[medoids] = -1
+        medoids.append(int(np.argmax(gains)))
+        nearest = np.minimum(nearest, distances[:, medoids[-1]])
+
+    medoids = np.array(medoids)
+    for _ in range(max_iterations):
+        to_medoids = distances[:, medoids]
+        order = np.argsort(to_medoids, axis=1)
+        first = to_medoids[np.arange(len(distances)), order[:, 0]]
+        second = to_medoids[np.arange(len(distances)), order[:, 1]] if n_clusters > 1 else np.full_like(first, np.inf)
+        cost = first.sum()
+
+        best = (cost, None, None)
+        for m in range(n_clusters):
+            others = np.where(order[:, 0] == m, second, first)
+            swap_costs = np.minimum(distances, others[:, np.newaxis]).sum(axis=0)
+            swap_costs[medoids] = np.inf
+            candidate = int(np.argmin(swap_costs))
+            if swap_costs[candidate] < best[0]:
+                best = (swap_costs[candidate], m, candidate)
+        if best[1] is None:
+            break
+        medoids[best[1]] = best[2]
+
+    return medoids, float(distances[:, medoids].min(axis=1).sum())
+
+
+def _clara(cache, n_clusters, n_samples, sample_size, rng):
+    sample_size = min(len(cache), max(n_clusters, 40 + 2 * n_clusters if sample_size is None else sample_size))
+    best_medoids, best_to_medoids, best_cost = None, None, np.inf
+    for _ in range(n_samples):
+        sample = rng.choice(len(cache), size=sample_size, replace=False)
+        if best_medoids is not None:
+            # The best medoids so far are part of every following sample.
+            rest = sample[~np.isin(sample, best_medoids)]
+            sample = np.concatenate((best_medoids, rest[:sample_size - n_clusters]))
+        sample_medoids, _ = _pam(cache.pairwise(sample, sample), n_clusters)
+        medoids = sample[sample_medoids]
+        to_medoids = cache.pairwise(np.arange(len(cache)), medoids)
+        cost = to_medoids.min(axis=1).sum()
+        if cost < best_cost:
+            best_medoids, best_to_medoids, best_cost = medoids, to_medoids, cost
+    return best_medoids, best_to_medoids
+
+
+def _clarans(cache, n_clusters, n_local, max_neighbors, rng):
+    n = len(cache)
+    max_neighbors = min(CLARANS_NEIGHBORS if max_neighbors is None else max_neighbors, n_clusters * (n - n_clusters))
+    best_medoids, best_to_medoids, best_cost = None, None, np.inf
+    for _ in range(n_local):
+        medoids = rng.choice(n, size=n_clusters, replace=False)
+        to_medoids = cache.pairwise(np.arange(n), medoids)
+        cost = to_medoids.min(axis=1).sum()
+        tries = 0
+        while tries < max_neighbors:
+            m = rng.integers(n_clusters)
+            candidate = rng.integers(n)
+            if candidate in medoids:
+                continue
+            others = np.delete(to_medoids, m, axis=1).min(axis=1) if n_clusters > 1 else np.inf
+            to_candidate = cache.pairwise(np.arange(n), [candidate])[:, 0]
+            swap_cost = np.minimum(others, to_candidate).sum()
+            if swap_cost < cost:
+                medoids[m], to_medoids[:, m], cost = candidate, to_candidate, swap_cost
+                tries = 0
+            else:
+                tries += 1
+        if cost < best_cost:
+            best_medoids, best_to_medoids, best_cost = medoids.copy(), to_medoids, cost
+    return best_medoids, best_to_medoids
+
+
+def k_medoids(X, n_clusters, method="clara", n_samples=5, sample_size=None, n_local=2, max_neighbors=None,
+              seed=0, **cache_options):
+    """
+    k-medoids clustering with DTW, computing only the distances the algorithm needs.
+
+    Parameters
+    ------------
+    :param X: tensor of N MTS (N x T x F), RaggedTensor, list of series or DistanceCache
+        (to reuse the distances of a previous call)
+    :param n_clusters: number of clusters
+    :param method: "clara" (PAM on samples) or "clarans" (randomized swaps)
+    :param n_samples: CLARA: number of samples
+    :param sample_size: CLARA: series per sample (default: 40 + 2 * n_clusters)
+    :param n_local: CLARANS: number of local searches
+    :param max_neighbors: CLARANS: failed swaps before a local search stops (default:
+        CLARANS_NEIGHBORS; Ng & Han suggest 1.25% of n_clusters * (N - n_clusters))
+    :param seed: seed of the random samples
+    :param cache_options: parameters of DistanceCache (type_dtw, local_dissimilarity,
+        constraints, n_threads, dtype, max_columns)
+
+    :return: (numpy.ndarray, numpy.ndarray, float)
+        Indices of the medoids, cluster of each series and sum of the DTW distances of
+        the series to their medoid.
+    """
+    cache = _distance_cache(X, cache_options)
+    if not 1 <= n_clusters <= len(cache):
+        raise ValueError('The number of clusters must be between 1 and the number of series.')
+    rng = np.random.default_rng(seed)
+    if method == "clara":
+        medoids, to_medoids = _clara(cache, n_clusters, n_samples, sample_size, rng)
+    elif method == "clarans":
+        medoids, to_medoids = _clarans(cache, n_clusters, n_local, max_neighbors, rng)
+    else:
+        raise ValueError('The k-medoids method must be "clara" or "clarans".')
+
+    labels = np.argmin(to_medoids, axis=1)
+    return medoids, labels, float(to_medoids[np.arange(len(cache)), labels].sum())
+
+
+def hierarchical_clustering(X, n_clusters, method="average", n_prototypes=HIERARCHICAL_PROTOTYPES, seed=0,
+                            **cache_options):
+    """
+    Agglomerative clustering with DTW. Up to n_prototypes series, the linkage is computed
+    on all of them; with more, the series are first summarized by n_prototypes CLARA
+    medoids, the linkage is computed on the medoids and each series takes the cluster of
+    its medoid.
+
+    Parameters
+    ------------
+    :param X: tensor of N MTS (N x T x F), RaggedTensor, list of series or DistanceCache
+    :param n_clusters: number of clusters
+    :param method: linkage of scipy.cluster.hierarchy ("single", "complete", "average", "weighted")
+    :param n_prototypes: maximum number of series in the linkage
+    :param seed: seed of the CLARA samples
+    :param cache_options: parameters of DistanceCache
+
+    :return: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        Cluster of each series (0 to n_clusters - 1), linkage matrix of the prototypes and
+        indices of the prototypes.
+    """
+    cache = _distance_cache(X, cache_options)
+    if len(cache) <= n_prototypes:
+        prototypes = np.arange(len(cache))
+        assignment = prototypes
+    else:
+        prototypes, assignment, _ = k_medoids(cache, n_prototypes, n_samples=1, seed=seed)
+
+    distances = cache.pairwise(prototypes, prototypes)
+    tree = linkage(squareform(distances, checks=False), method=method)
+    prototype_labels = fcluster(tree, n_clusters, criterion="maxclust") - 1
+    return prototype_labels[assignment], tree, prototypes
@@ -0,0 +1,367 @@
+import json
+import sys
+import os.path
+import socket
+import threading
+import time
+import multiprocessing as mp
+from multiprocessing.managers import BaseManager
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from dtw_functions import dtw_tensor_3d_blocks, warm_up
+from output_writers import open_writer
+from ragged import load_tensor
+from scheduling import ScheduleReport
+
+# Distributed mode: the DTW matrix between two tensors is split into tiles computed by
+# worker processes on several hosts.
+#
+#   - The coordinator serves the tiles over TCP (multiprocessing managers, authenticated
+#     with authkey). A worker leases a tile, computes it with dtw_tensor_3d_blocks on its
+#     own cores and renews the lease after every row block.
+#   - Tiles are written to a shared directory, each one to its own .npy file, renamed
+#     into place once complete. The directory also holds tiles.json with the shape of the
+#     matrix; a coordinator started again on the same directory skips the tiles that
+#     already exist.
+#   - A tile whose worker raises an error, or whose lease is not renewed within
+#     tile_timeout seconds (lost host), is queued again; after max_retries failures the
+#     computation stops with an error.
+#   - Finally the coordinator assembles the tiles, one row of tiles at a time, into the
+#     output file (.npy, .npz or .csv).
+#
+# The tensors are read by the workers from paths that must be valid on every host (a
+# shared file system), like the tile directory.
+#
+# Trust model: multiprocessing managers exchange pickled objects, and unpickling can run
+# arbitrary code. The authentication key is the only barrier: whoever knows it can run
+# code on the coordinator, and a coordinator can run code on the workers that connect to
+# it. There is no default key (it is given explicitly, with an authkey file or with the
+# DTWPARALLEL_AUTHKEY environment variable), the coordinator listens on 127.0.0.1 unless
+# another address is given, and it should only be exposed on a trusted network.
+
+TILE_SIZE = 1024
+TILE_TIMEOUT = 600
+DEFAULT_PORT = 8766
+AUTHKEY_ENV = 'DTWPARALLEL_AUTHKEY'
+
+# Attributes of input_obj sent to the workers.
+JOB_OPTIONS = ('type_dtw', 'constrained_path_search', 'local_dissimilarity', 'MTS', 'visualization',
+               'check_errors', 'regular_flag', 'itakura_max_slope', 'sakoe_chiba_radius', 'dtype')
+
+
+def tile_path(directory, tile):
+    return os.path.join(directory, 'tile_{}_{}.npy'.format(tile['rows'][0], tile['cols'][0]))
+
+
+def make_tiles(shape, tile_size=TILE_SIZE):
+    """
+    Tiles of at most tile_size x tile_size covering a matrix, by rows of tiles.
+    """
+    return [{'id': k, 'rows': (r, min(r + tile_size, shape[0])), 'cols': (c, min(c + tile_size, shape[1]))}
+            for k, (r, c) in enumerate((r, c) for r in range(0, shape[0], tile_size)
+                                       for c in range(0, shape[1], tile_size))]
+
+
+class TileCoordinator:
+    """
+    State of a distributed computation: pending, leased and completed tiles. Its public
+    methods are called by the workers through the manager, from one thread per connection.
+    """
+    def __init__(self, job, tiles, done=(), max_retries=3, tile_timeout=TILE_TIMEOUT):
+        self._job = job
+        self.tiles = {tile['id']: tile for tile in tiles}
+        self.done = set(done)
+        self.pending = [tile['id'] for tile in tiles if tile['id'] not in self.done]
+        self.leases = {}
+        self.failures = {}
+        self.errors = []
+        self.max_retries = max_retries
+        self.tile_timeout = tile_timeout
+        self.report = ScheduleReport()
+        self.workers = set()
+        self.lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return len(self.done) == len(self.tiles) or self.failed
+
+    @property
+    def failed(self):
+        return any(count > self.max_retries for count in self.failures.values())
+
+    def _fail(self, tile_id, error):
+        self.leases.pop(tile_id, None)
+        self.failures[tile_id] = self.failures.get(tile_id, 0) + 1
+        self.errors.append('tile {}: {}'.format(tile_id, error))
+        self.pending.insert(0, tile_id)
+
+    def _expire(self):
+        now = time.monotonic()
+        for tile_id, (worker, renewed) in list(self.leases.items()):
+            if now - renewed > self.tile_timeout:
+                self._fail(tile_id, 'lease of {} expired'.format(worker))
+
+    def job(self):
+        return self._job
+
+    def next_tile(self, worker):
+        """
+        Tile leased to the worker; {} if every remaining tile is leased (ask again
+        later); None when the computation is over.
+        """
+        with self.lock:
+            self._expire()
+            if self.finished:
+                return None
+            if not self.pending:
+                return {}
+            tile_id = self.pending.pop(0)
+            self.leases[tile_id] = (worker, time.monotonic())
+            self.workers.add(worker)
+            return self.tiles[tile_id]
+
+    def renew(self, tile_id, worker):
+        """
+        Extend the lease of a tile; False if it is no longer leased to the worker.
+        """
+        with self.lock:
+            if self.leases.get(tile_id, (None,))[0] != worker:
+                return False
+            self.leases[tile_id] = (worker, time.monotonic())
+            return True
+
+    def tile_done(self, tile_id, worker, busy_time):
+        with self.lock:
+            self.leases.pop(tile_id, None)
+            if tile_id in self.pending:
+                # Completed after its lease had expired: no need to compute it again.
+                self.pending.remove(tile_id)
+            if tile_id not in self.done:
+                self.done.add(tile_id)
+                tile = self.tiles[tile_id]
+                pairs = (tile['rows'][1] - tile['rows'][0]) * (tile['cols'][1] - tile['cols'][0])
+                self.report.add(pairs, [pairs], [busy_time], 0.)
+
+    def tile_failed(self, tile_id, worker, error):
+        with self.lock:
+            if self.leases.get(tile_id, (None,))[0] == worker and tile_id not in self.done:
+                self._fail(tile_id, '{} on {}'.format(error, worker))
+
+
+def resolve_authkey(authkey=None, authkey_file=None):
+    """
+    Authentication key of the coordinator and the workers: authkey, else the first line of
+    authkey_file, else the AUTHKEY_ENV environment variable. There is no default key.
+
+    :return: bytes
+    """
+    if authkey is None and authkey_file is not None:
+        with open(authkey_file) as file:
+            authkey = file.readline().strip()
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        raise ValueError('An authentication key is required: give authkey or authkey_file, or set {}.'.format(
+            AUTHKEY_ENV))
+    return authkey if isinstance(authkey, bytes) else authkey.encode()
+
+
+class _CoordinatorManager(BaseManager):
+    pass
+
+
+class _WorkerManager(BaseManager):
+    pass
+
+
+_WorkerManager.register('coordinator')
+
+
+def _open_directory(directory, shape, tile_size, dtype):
+    """
+    Create the tile directory, or check that an existing one belongs to the same matrix.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'shape': list(shape), 'tile_size': tile_size, 'dtype': str(np.dtype(dtype))}
+    path = os.path.join(directory, 'tiles.json')
+    if os.path.exists(path):
+        with open(path) as file:
+            if json.load(file) != manifest:
+                raise ValueError('{} holds the tiles of another matrix.'.format(directory))
+    else:
+        with open(path, 'w') as file:
+            json.dump(manifest, file)
+
+
+def assemble_tiles(directory, path, dtype="float64"):
+    """
+    Write the tiles of a directory to a single output file, one row of tiles at a time.
+
+    :param directory: tile directory of a finished computation
+    :param path: output file (.npy, .npz or .csv)
+    """
+    with open(os.path.join(directory, 'tiles.json')) as file:
+        manifest = json.load(file)
+    shape = tuple(manifest['shape'])
+    tile_size = manifest['tile_size']
+    writer = open_writer(path, shape, dtype=dtype)
+    try:
+        for start in range(0, shape[0], tile_size):
+            row = [tile for tile in make_tiles(shape, tile_size) if tile['rows'][0] == start]
+            writer.write(start, np.hstack([np.load(tile_path(directory, tile)) for tile in row]))
+    finally:
+        writer.close()
+
+
+def run_coordinator(X, Y, input_obj, directory, output=None, host='127.0.0.1', port=DEFAULT_PORT,
+                    authkey=None, tile_size=TILE_SIZE, max_retries=3, tile_timeout=TILE_TIMEOUT,
+                    local_workers=0, report=None):
+    """
+    Serve the tiles of the DTW matrix between the tensors in X and Y until all of them
+    are computed, then assemble them.
+
+    Parameters
+    ------------
+    :param X: path of a .npy tensor or .npz RaggedTensor, readable by every worker
+    :param Y: path of another tensor (X if None)
+    :param input_obj: object with the DTW parameters
+    :param directory: shared directory of the tiles
+    :param output: optional output file (.npy, .npz or .csv)
+    :param host: address the coordinator listens on ('0.0.0.0': all the interfaces, only
+        on a trusted network)
+    :param port: TCP port (0: any free port)
+    :param authkey: key shared by the coordinator and the workers (see resolve_authkey)
+    :param tile_size: rows and columns of a tile
+    :param max_retries: retries of a tile before the computation fails
+    :param tile_timeout: seconds without news of a leased tile before it is queued again
+    :param local_workers: worker processes started on this host (they use input_obj.n_threads)
+    :param report: optional scheduling.ScheduleReport filled with the busy time of the tiles
+
+    :return: TileCoordinator
+        Final state, with the errors of the failed attempts.
+    """
+    authkey = resolve_authkey(authkey)
+    X = os.path.abspath(X)
+    Y = X if Y is None else os.path.abspath(Y)
+    shape = (len(load_tensor(X)), len(load_tensor(Y)))
+    dtype = getattr(input_obj, "dtype", "float64")
+    _open_directory(directory, shape, tile_size, dtype)
+
+    tiles = make_tiles(shape, tile_size)
+    done = [tile['id'] for tile in tiles if os.path.exists(tile_path(directory, tile))]
+    job = {'X': X, 'Y': Y, 'directory': os.path.abspath(directory),
+           'options': {name: getattr(input_obj, name, None) for name in JOB_OPTIONS}}
+    coordinator = TileCoordinator(job, tiles, done, max_retries, tile_timeout)
+
+    _CoordinatorManager.register('coordinator', callable=lambda: coordinator)
+    server = _CoordinatorManager(address=(host, port), authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    address = server.address
+    sys.stderr.write('dtwParallel coordinating {} tiles ({} done) of a {} x {} matrix on {}:{}\n'.format(
+        len(tiles), len(done), shape[0], shape[1], *address[:2]))
+
+    # No local worker is started when every tile is already on disk (resumed computation).
+    worker_address = ('127.0.0.1' if host in ('', '0.0.0.0') else host, address[1])
+    workers = [mp.get_context('spawn').Process(target=run_worker, args=(worker_address, authkey),
+                                               kwargs={'n_threads': input_obj.n_threads})
+               for _ in range(0 if coordinator.finished else local_workers)]
+    began = time.perf_counter()
+    try:
+        for worker in workers:
+            worker.start()
+        while True:
+            with coordinator.lock:
+                coordinator._expire()
+                if coordinator.finished:
+                    break
+            time.sleep(0.2)
+    finally:
+        server.stop_event.set()
+        server.listener.close()
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+    coordinator.report.n_workers = max(1, len(coordinator.workers))
+    coordinator.report.wall_time = time.perf_counter() - began
+    if report is not None:
+        report.n_workers = coordinator.report.n_workers
+        report.add(coordinator.report.n_tasks, coordinator.report.estimated_costs,
+                   coordinator.report.busy_times, coordinator.report.wall_time)
+    if coordinator.failed:
+        raise RuntimeError('Distributed computation failed:\n' + '\n'.join(coordinator.errors))
+    if output is not None:
+        assemble_tiles(directory, output, dtype)
+    return coordinator
+
+
+def _compute_tile(X, Y, tile, input_obj, directory, coordinator, worker):
+    (r0, r1), (c0, c1) = tile['rows'], tile['cols']
+    data = np.empty((r1 - r0, c1 - c0), dtype=input_obj.dtype)
+    for start, block in dtw_tensor_3d_blocks(X[r0:r1], Y[c0:c1], input_obj):
+        data[start:start + block.shape[0]] = block
+        coordinator.renew(tile['id'], worker)
+
+    path = tile_path(directory, tile)
+    partial = '{}.{}.tmp.npy'.format(path[:-4], worker.replace(':', '_'))
+    np.save(partial, data)
+    os.replace(partial, path)
+
+
+def run_worker(address, authkey=None, n_threads=-1, poll_interval=1., connect_timeout=60.):
+    """
+    Compute tiles of a coordinator until the computation is over.
+
+    :param address: (host, port) of the coordinator
+    :param authkey: key shared with the coordinator (see resolve_authkey)
+    :param n_threads: processes used for each tile on this host
+    :param poll_interval: seconds between requests while every tile is leased
+    :param connect_timeout: seconds to wait for the coordinator to start listening
+    :return: number of tiles computed
+    """
+    manager = _WorkerManager(address=tuple(address), authkey=resolve_authkey(authkey))
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            manager.connect()
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(poll_interval)
+
+    computed = 0
+    try:
+        coordinator = manager.coordinator()
+        job = coordinator.job()
+        X = load_tensor(job['X'])
+        Y = X if job['Y'] == job['X'] else load_tensor(job['Y'])
+        input_obj = SimpleNamespace(n_threads=n_threads, **job['options'])
+        worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+        warm_up()
+
+        while True:
+            tile = coordinator.next_tile(worker)
+            if tile is None:
+                break
+            if not tile:
+                time.sleep(poll_interval)
+                continue
+
+            began = time.perf_counter()
+            try:
+                _compute_tile(X, Y, tile, input_obj, job['directory'], coordinator, worker)
+            except Exception as error:
+                coordinator.tile_failed(tile['id'], worker, '{}: {}'.format(type(error).__name__, error))
+                continue
+            coordinator.tile_done(tile['id'], worker, time.perf_counter() - began)
+            computed += 1
+    except (EOFError, ConnectionError):
+        # The coordinator finished (or was stopped) before or while this worker was waiting.
+        pass
+    return computed
@@ -1,5 +1,7 @@
 import csv
+import shutil
 import sys
+import tempfile
 import pandas as pd
 import os.path
 import numpy as np
@@ -9,7 +11,9 @@ sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 # Created functions
 from error_control import possible_distances
 from utils import *
-from dtw_functions import dtw, dtw_tensor_3d
+from dtw_functions import dtw, dtw_tensor_3d_blocks, transform_dtw_to_kernel
+from output_writers import open_writer, output_path
+from scheduling import ScheduleReport
 
 
 
@@ -47,12 +51,50 @@ def input_File():
 def control_output(input_obj, dtw_distance):
 
     if input_obj.output_file:
-        sys.stdout.write("Output to "  + input_obj.name_file + ".csv")
-        pd.DataFrame(np.array([dtw_distance])).to_csv(input_obj.name_file + ".csv", float_format='%g', index=False)
+        path = output_path(input_obj.name_file)
+        sys.stdout.write("Output to "  + path)
+        writer = open_writer(path, (1, 1))
+        writer.write(0, np.array([[dtw_distance]]))
+        writer.close()
     else:
         sys.stdout.write(str(dtw_distance)+"\n")
 
 
+def stream_output(input_obj, blocks, shape):
+    """
+    Write the row blocks of a DTW matrix as they are computed: to a file whose format
+    (.npy, .npz or .csv) follows the extension of name_file, or to the terminal.
+    With dtw_to_kernel, the kernel goes to a second file with the "_kernel" suffix.
+    """
+    if input_obj.output_file:
+        path = output_path(input_obj.name_file)
+        writers = [open_writer(path, shape, dtype=input_obj.dtype)]
+        if input_obj.dtw_to_kernel:
+            writers.append(open_writer(output_path(input_obj.name_file, "_kernel"), shape, dtype=input_obj.dtype))
+        sys.stdout.write("Output to " + ", ".join(writer.path for writer in writers))
+        try:
+            for start, block in blocks:
+                writers[0].write(start, block)
+                if input_obj.dtw_to_kernel:
+                    writers[1].write(start, transform_dtw_to_kernel(block, input_obj.sigma_kernel))
+        finally:
+            for writer in writers:
+                writer.close()
+    else:
+        # The kernel is printed after the whole distance matrix: its rows wait in a
+        # temporary file rather than in memory.
+        with tempfile.TemporaryFile(mode='w+') as kernel_file:
+            for start, block in blocks:
+                np.savetxt(sys.stdout, block, fmt='%g')
+                sys.stdout.flush()
+                if input_obj.dtw_to_kernel:
+                    np.savetxt(kernel_file, transform_dtw_to_kernel(block, input_obj.sigma_kernel), fmt='%g')
+            if input_obj.dtw_to_kernel:
+                sys.stdout.write("\n")
+                kernel_file.seek(0)
+                shutil.copyfileobj(kernel_file, sys.stdout)
+
+
 def main():
     # If you only make use of the library you will get an error.
     if len(sys.argv) == 1:
@@ -62,6 +104,61 @@ def main():
 	
     # Generate an object with the deafult parameters
     input_obj = Input()
+
+    # Batch mode: many pair jobs answered by a single process.
+    if sys.argv[1] == "batch":
+        from batch import run_batch
+
+        args, input_obj = parse_args(False, command="batch")
+        failed = run_batch(args.jobs, input_obj)
+        sys.exit(1 if failed else 0)
+
+    # Server mode: long-running local service.
+    if sys.argv[1] == "serve":
+        from server import serve
+
+        args, input_obj = parse_args(False, command="serve")
+        serve(input_obj, host=args.host, port=args.port, socket_path=args.socket, reference=args.reference,
+              data_dir=args.data_dir)
+        sys.exit(0)
+	
+    # Distributed mode: a coordinator serves the tiles of a matrix to workers on any host.
+    if sys.argv[1] == "coordinate":
+        from distributed import resolve_authkey, run_coordinator
+
+        args, input_obj = parse_args(False, command="coordinate")
+        input_obj.MTS = True
+        output = output_path(input_obj.name_file) if input_obj.output_file else None
+        report = ScheduleReport() if input_obj.schedule_report else None
+        try:
+            authkey = resolve_authkey(args.authkey, args.authkey_file)
+            run_coordinator(args.X, args.Y, input_obj, args.tiles, output=output, host=args.host, port=args.port,
+                            authkey=authkey, tile_size=args.tile_size, max_retries=args.retries,
+                            tile_timeout=args.tile_timeout, local_workers=args.local_workers, report=report)
+        except (ValueError, RuntimeError) as error:
+            sys.stderr.write(str(error) + "\n")
+            sys.exit(1)
+        if output is not None:
+            sys.stdout.write("Output to " + output)
+        if report is not None:
+            sys.stderr.write("\n" + str(report) + "\n")
+        sys.exit(0)
+
+    if sys.argv[1] == "worker":
+        from multiprocessing import AuthenticationError
+        from distributed import resolve_authkey, run_worker
+
+        args, input_obj = parse_args(False, command="worker")
+        try:
+            run_worker((args.host, args.port), resolve_authkey(args.authkey, args.authkey_file),
+                       n_threads=input_obj.n_threads)
+        except ValueError as error:
+            sys.stderr.write(str(error) + "\n")
+            sys.exit(1)
+        except (ConnectionError, AuthenticationError) as error:
+            sys.stderr.write("Cannot reach the coordinator at {}:{}: {}\n".format(args.host, args.port, error))
+            sys.exit(1)
+        sys.exit(0)
 	
     # Input type 1: input by files
     if os.path.exists(sys.argv[1]):
@@ -69,21 +166,25 @@ def main():
         if sys.argv[1].endswith('.csv'):
             input_obj = input_File()
             
-            dtw_distance = dtw(input_obj.x, input_obj.y, type_dtw=input_obj.type_dtw, constrained_path_search=input_obj.constrained_path_search, local_dissimilarity=input_obj.local_dissimilarity, MTS=input_obj.MTS, get_visualization=input_obj.visualization, check_errors=input_obj.check_errors, term_exec=True)
+            dtw_distance = dtw(input_obj.x, input_obj.y, type_dtw=input_obj.type_dtw, constrained_path_search=input_obj.constrained_path_search, local_dissimilarity=input_obj.local_dissimilarity, MTS=input_obj.MTS, get_visualization=input_obj.visualization, check_errors=input_obj.check_errors, term_exec=True, dtype=input_obj.dtype)
 
         # input 3D file. We include the possibility to parallelise.
-        elif sys.argv[1].endswith('.npy'):
+        elif sys.argv[1].endswith(('.npy', '.npz')):
 
             args, input_obj = parse_args(True)
             input_obj.MTS = True
-            if len(sys.argv) > 2 and sys.argv[2].endswith('.npy'):
+            if len(sys.argv) > 2 and sys.argv[2].endswith(('.npy', '.npz')):
                 X, Y = read_npy(args.X), read_npy(args.Y)
             else:
                 X = read_npy(args.X)
                 Y = X
 
-            dtw_distance = dtw_tensor_3d(X, Y, input_obj)
-            
+            report = ScheduleReport() if input_obj.schedule_report else None
+            stream_output(input_obj, dtw_tensor_3d_blocks(X, Y, input_obj, report=report), (len(X), len(Y)))
+            if report is not None:
+                sys.stderr.write("\n" + str(report) + "\n")
+            return
+
         control_output(input_obj, dtw_distance)
             
     # Input type 2: input by terminal
@@ -97,7 +198,7 @@ def main():
         input_obj.x = [[value] for value in args.x]
         input_obj.y = [[value] for value in args.y]
 
-        dtw_distance = dtw(input_obj.x, input_obj.y, type_dtw=input_obj.type_dtw, constrained_path_search=input_obj.constrained_path_search, local_dissimilarity=input_obj.local_dissimilarity, MTS=input_obj.MTS, get_visualization=input_obj.visualization, check_errors=input_obj.check_errors, term_exec=True)
+        dtw_distance = dtw(input_obj.x, input_obj.y, type_dtw=input_obj.type_dtw, constrained_path_search=input_obj.constrained_path_search, local_dissimilarity=input_obj.local_dissimilarity, MTS=input_obj.MTS, get_visualization=input_obj.visualization, check_errors=input_obj.check_errors, term_exec=True, dtype=input_obj.dtype)
         
         control_output(input_obj, dtw_distance)
         
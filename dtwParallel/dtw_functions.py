@@ -9,50 +9,46 @@ import numpy as np
 from collections import defaultdict
 import pandas as pd
 import warnings
+import time
 
-import gower
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, effective_n_jobs
 from scipy.spatial import distance
 
 import sys
 import os.path
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 
+# This module is imported both flat (dtw_functions, by the CLI) and as
+# dtwParallel.dtw_functions. The numba disk cache records the importing name and
+# re-imports it on load, so both names must resolve to this module.
+for _module_name in ("dtw_functions", "dtwParallel.dtw_functions"):
+    sys.modules.setdefault(_module_name, sys.modules[__name__])
+
 from error_control import control_inputs
-import utils_visualizations as uv
+from ragged import RaggedTensor
+from scheduling import CHUNKS_PER_WORKER, balanced_chunks, pair_costs, timed
 
+import numba
 from numba import njit, prange
 
 GLOBAL_CONSTRAINT_CODE = {None: 0, "": 0, "itakura": 1, "sakoe_chiba": 2}
 
 
-def to_time_series(ts):
+def to_time_series(ts, dtype="float64"):
     ts_out = np.array(ts, copy=True)
     if ts_out.ndim <= 1:
         ts_out = ts_out.reshape((-1, 1))
-    if ts_out.dtype != float:
-        ts_out = ts_out.astype('float64')
+    if ts_out.dtype != dtype:
+        ts_out = ts_out.astype(dtype)
     
     return ts_out
 
 
-@njit()
-def _njit_itakura_mask(sz1, sz2, max_slope=2.):
-    """Compute the Itakura mask without checking that the constraints
-    are feasible. In most cases, you should use itakura_mask instead.
-    Parameters
-    ----------
-    sz1 : int
-        The size of the first time series
-    sz2 : int
-        The size of the second time series.
-    max_slope : float (default = 2)
-        The maximum slope of the parallelogram.
-    Returns
-    -------
-    mask : array, shape = (sz1, sz2)
-        Itakura mask.
-    """
+@njit(cache=True)
+def _njit_itakura_bounds(sz1, sz2, max_slope=2.):
+    """Row bounds of each column of the Itakura parallelogram: column i
+    admits the rows lower_bound[i] <= row < upper_bound[i]. Both bounds are
+    non-decreasing in i."""
     min_slope = 1 / float(max_slope)
     max_slope *= (float(sz1) / float(sz2))
     min_slope *= (float(sz1) / float(sz2))
@@ -76,6 +72,27 @@ def _njit_itakura_mask(sz1, sz2, max_slope=2.):
         upper_bound_[i] = min(round(upper_bound[0, i], 2),
                               round(upper_bound[1, i], 2))
     upper_bound_ = np.floor(upper_bound_ + 1)
+    return lower_bound_, upper_bound_
+
+
+@njit(cache=True)
+def _njit_itakura_mask(sz1, sz2, max_slope=2.):
+    """Compute the Itakura mask without checking that the constraints
+    are feasible. In most cases, you should use itakura_mask instead.
+    Parameters
+    ----------
+    sz1 : int
+        The size of the first time series
+    sz2 : int
+        The size of the second time series.
+    max_slope : float (default = 2)
+        The maximum slope of the parallelogram.
+    Returns
+    -------
+    mask : array, shape = (sz1, sz2)
+        Itakura mask.
+    """
+    lower_bound_, upper_bound_ = _njit_itakura_bounds(sz1, sz2, max_slope)
 
     mask = np.full((sz1, sz2), np.inf)
     for i in prange(sz2):
@@ -129,7 +146,7 @@ def itakura_mask(sz1, sz2, max_slope=2.):
     return mask
 
 
-@njit()
+@njit(cache=True)
 def sakoe_chiba_mask(sz1, sz2, radius=1):
     """Compute the Sakoe-Chiba mask.
     Parameters
@@ -240,66 +257,346 @@ def compute_mask(s1, s2, global_constraint=0,
     return mask
 
 
-@njit()
+def constraint_row_bounds(sz1, sz2, constrained_path_search=None,
+                          sakoe_chiba_radius=None, itakura_max_slope=None):
+    """
+    Admissible region of the global constraint as row bounds: row i admits the columns
+    row_lo[i] <= j < row_hi[i]. It is the same region as get_mask, in O(sz1) memory
+    instead of O(sz1 * sz2); both bounds are non-decreasing in i.
+
+    :return: (numpy.ndarray, numpy.ndarray)
+        row_lo and row_hi (int64)
+    """
+    global_constraint = GLOBAL_CONSTRAINT_CODE[constrained_path_search]
+    rows = np.arange(sz1)
+
+    if global_constraint == 2 or (global_constraint == 0
+                                  and sakoe_chiba_radius is not None):
+        radius = 1 if sakoe_chiba_radius is None else int(sakoe_chiba_radius)
+        if sz1 > sz2:
+            row_lo = np.maximum(0, rows - (sz1 - sz2 + radius))
+            row_hi = np.minimum(sz2, rows + radius + 1)
+        else:
+            row_lo = np.maximum(0, rows - radius)
+            row_hi = np.minimum(sz2, rows + sz2 - sz1 + radius + 1)
+    elif global_constraint == 1 or (global_constraint == 0
+                                    and itakura_max_slope is not None):
+        max_slope = 2. if itakura_max_slope is None else itakura_max_slope
+        col_lo, col_hi = _njit_itakura_bounds(sz1, sz2, max_slope)
+        row_lo = np.searchsorted(col_hi, rows, side='right')
+        row_hi = np.searchsorted(col_lo, rows, side='right')
+    else:
+        row_lo = np.zeros(sz1, dtype=np.int64)
+        row_hi = np.full(sz1, sz2, dtype=np.int64)
+
+    return row_lo.astype(np.int64), np.maximum(row_lo, row_hi).astype(np.int64)
+
+
+@njit(cache=True, nogil=True)
 def norm2(s1, s2):
-    dist = 0.
+    dist = s1.dtype.type(0)
     for di in range(s1.shape[0]):
         diff = np.abs(s1[di] - s2[di])
         dist += diff * diff
     return np.sqrt(dist)
 
 
-@njit()
+@njit(cache=True, nogil=True)
 def norm1(s1, s2):
-    dist = 0.
+    dist = s1.dtype.type(0)
     for di in range(s1.shape[0]):
         dist += np.abs(s1[di] - s2[di])
     return np.sqrt(dist)
 
 
-@njit()
+@njit(cache=True, nogil=True)
 def square_euclidean_distance(s1, s2):
-    dist = 0.
+    dist = s1.dtype.type(0)
     for di in range(s1.shape[0]):
         diff = s1[di] - s2[di]
         dist += diff * diff
     return dist
 
 
-@njit()
-def general_dtw_ind(type_distance, mask, len_ts1, len_ts2, ts1, ts2, cost_matrix):
+# Codes of the local dissimilarities with a compiled implementation. The compiled DTW
+# kernel dispatches on this code instead of receiving the dissimilarity as a
+# first-class function: numba cannot cache functions specialised on a function
+# argument, which made every fresh process (and every joblib worker) re-JIT them.
+LOCAL_DISSIMILARITY_CODE = {"norm1": 0, "norm2": 1, "square_euclidean_distance": 2}
+
+
+@njit(cache=True, nogil=True)
+def local_cost(dissimilarity_code, s1, s2):
+    if dissimilarity_code == 0:
+        return norm1(s1, s2)
+    elif dissimilarity_code == 1:
+        return norm2(s1, s2)
+    return square_euclidean_distance(s1, s2)
+
+
+@njit(cache=True, nogil=True)
+def _dtw_kernel_norm1(mask, len_ts1, len_ts2, ts1, ts2, cost_matrix):
+    for i in range(len_ts1):
+        for j in range(len_ts2):
+            if np.isfinite(mask[i, j]):
+                cost_matrix[i + 1, j + 1] = norm1(ts1[i], ts2[j]) + min(cost_matrix[i, j + 1],
+                                                                        cost_matrix[i + 1, j],
+                                                                        cost_matrix[i, j])
+    return cost_matrix
+
+
+@njit(cache=True, nogil=True)
+def _dtw_kernel_norm2(mask, len_ts1, len_ts2, ts1, ts2, cost_matrix):
+    for i in range(len_ts1):
+        for j in range(len_ts2):
+            if np.isfinite(mask[i, j]):
+                cost_matrix[i + 1, j + 1] = norm2(ts1[i], ts2[j]) + min(cost_matrix[i, j + 1],
+                                                                        cost_matrix[i + 1, j],
+                                                                        cost_matrix[i, j])
+    return cost_matrix
+
 
+@njit(cache=True, nogil=True)
+def _dtw_kernel_square_euclidean(mask, len_ts1, len_ts2, ts1, ts2, cost_matrix):
     for i in range(len_ts1):
         for j in range(len_ts2):
             if np.isfinite(mask[i, j]):
-                cost_matrix[i + 1, j + 1] = type_distance(ts1[i], ts2[j])
-                cost_matrix[i + 1, j + 1] += min(cost_matrix[i, j + 1],
-                                             cost_matrix[i + 1, j],
-                                             cost_matrix[i, j])
+                cost_matrix[i + 1, j + 1] = square_euclidean_distance(ts1[i], ts2[j]) + min(cost_matrix[i, j + 1],
+                                                                                            cost_matrix[i + 1, j],
+                                                                                            cost_matrix[i, j])
     return cost_matrix
 
 
+@njit(cache=True, nogil=True)
+def dtw_kernel(dissimilarity_code, mask, len_ts1, len_ts2, ts1, ts2, cost_matrix):
+    # The code is resolved once per call: branching on it for every cell keeps the local
+    # cost from being inlined into the recursion, which was several times slower.
+    if dissimilarity_code == 0:
+        return _dtw_kernel_norm1(mask, len_ts1, len_ts2, ts1, ts2, cost_matrix)
+    elif dissimilarity_code == 1:
+        return _dtw_kernel_norm2(mask, len_ts1, len_ts2, ts1, ts2, cost_matrix)
+    return _dtw_kernel_square_euclidean(mask, len_ts1, len_ts2, ts1, ts2, cost_matrix)
+
+
+# Pairs with at least this many cells (len_ts1 * len_ts2) are computed by the wavefront
+# kernel when only the distance is needed.
+WAVEFRONT_MIN_CELLS = 10 ** 8
+
+
+@njit(cache=True, nogil=True)
+def _wavefront_min(prev1, prev2, i):
+    return min(prev1[i], prev1[i + 1], prev2[i])
+
+
+@njit(cache=True, parallel=True)
+def dtw_wavefront_kernel(dissimilarity_code, row_lo, row_hi, ts1, ts2):
+    """
+    DTW distance computed by anti-diagonals. The cells of an anti-diagonal only depend
+    on the two previous ones, so each diagonal is split across threads, and only three
+    diagonals are kept in memory. Entry i + 1 of a diagonal buffer holds row i; entry 0
+    is the virtual row -1.
+    """
+    len_ts1, len_ts2 = ts1.shape[0], ts2.shape[0]
+    prev2 = np.full(len_ts1 + 1, np.inf, ts1.dtype)
+    prev1 = np.full(len_ts1 + 1, np.inf, ts1.dtype)
+    cur = np.full(len_ts1 + 1, np.inf, ts1.dtype)
+    # D(-1, -1) = 0 seeds cell (0, 0).
+    prev2[0] = 0.
+
+    # Rows of the band on the current diagonal: [first, last]. Both only move forward.
+    first, last = 0, -1
+    # First row written on each buffer the last time it was the current diagonal.
+    written = np.zeros(3, np.int64)
+
+    for diagonal in range(len_ts1 + len_ts2 - 1):
+        while first < len_ts1 and first + row_hi[first] <= diagonal:
+            first += 1
+        while last + 1 < len_ts1 and last + 1 + row_lo[last + 1] <= diagonal:
+            last += 1
+
+        # Rows that left the band since this buffer was last written must read as inf.
+        slot = diagonal % 3
+        for i in range(written[slot], min(first, last + 1)):
+            cur[i + 1] = np.inf
+        written[slot] = first
+
+        if dissimilarity_code == 0:
+            for i in prange(first, last + 1):
+                cur[i + 1] = norm1(ts1[i], ts2[diagonal - i]) + _wavefront_min(prev1, prev2, i)
+        elif dissimilarity_code == 1:
+            for i in prange(first, last + 1):
+                cur[i + 1] = norm2(ts1[i], ts2[diagonal - i]) + _wavefront_min(prev1, prev2, i)
+        else:
+            for i in prange(first, last + 1):
+                cur[i + 1] = square_euclidean_distance(ts1[i], ts2[diagonal - i]) + _wavefront_min(prev1, prev2, i)
+
+        if diagonal == 0:
+            prev2[0] = np.inf
+        prev2, prev1, cur = prev1, cur, prev2
+
+    if len_ts1 + len_ts2 - 2 < 0:
+        return np.inf
+    return prev1[len_ts1]
+
+
+def dtw_wavefront(ts1, ts2, local_dissimilarity="norm2", constrained_path_search=None,
+                  sakoe_chiba_radius=None, itakura_max_slope=None, dtype="float64"):
+    """
+    Dependent DTW distance between two (long) time series with the wavefront kernel. It
+    uses O(len(ts1)) memory and all the numba threads, but does not build the cost
+    matrix, so there is no visualization.
+
+    Parameters
+    ------------
+    :param ts1: time serie 1
+    :param ts2: time serie 2
+    :param local_dissimilarity: "norm1", "norm2" or "square_euclidean_distance"
+    :param constrained_path_search: type constraint (None, sakoe-chiba o itakura)
+    :param sakoe_chiba_radius: int or None
+    :param itakura_max_slope: float or None
+    :param dtype: "float64" or "float32"
+
+    :return: float
+        DTW distance
+    """
+    ts1 = to_time_series(ts1, dtype)
+    ts2 = to_time_series(ts2, dtype)
+    row_lo, row_hi = constraint_row_bounds(ts1.shape[0], ts2.shape[0], constrained_path_search,
+                                           sakoe_chiba_radius, itakura_max_slope)
+    distance_value = dtw_wavefront_kernel(LOCAL_DISSIMILARITY_CODE[local_dissimilarity], row_lo, row_hi, ts1, ts2)
+    return ts1.dtype.type(distance_value)
+
+
+@njit(cache=True, nogil=True)
+def _dtw_rolling_rows(dissimilarity_code, row_lo, row_hi, ts1, ts2):
+    """
+    DTW distance with two rolling rows of the cost matrix. Row i only computes the
+    columns admitted by the constraint, row_lo[i] <= j < row_hi[i]; the entries left
+    of the band are reset and those right of it were never written, so both read as inf.
+    """
+    len_ts1, len_ts2 = ts1.shape[0], ts2.shape[0]
+    prev = np.full(len_ts2 + 1, np.inf, ts1.dtype)
+    cur = np.full(len_ts2 + 1, np.inf, ts1.dtype)
+    prev[0] = 0.
+
+    for i in range(len_ts1):
+        lo, hi = row_lo[i], row_hi[i]
+        cur[lo] = np.inf
+        if dissimilarity_code == 0:
+            for j in range(lo, hi):
+                cur[j + 1] = norm1(ts1[i], ts2[j]) + min(prev[j + 1], cur[j], prev[j])
+        elif dissimilarity_code == 1:
+            for j in range(lo, hi):
+                cur[j + 1] = norm2(ts1[i], ts2[j]) + min(prev[j + 1], cur[j], prev[j])
+        else:
+            for j in range(lo, hi):
+                cur[j + 1] = square_euclidean_distance(ts1[i], ts2[j]) + min(prev[j + 1], cur[j], prev[j])
+        prev, cur = cur, prev
 
-def dtw_ind(ts1, ts2, local_dissimilarity, mask, dtw_distance=0, get_visualization=False):
+    return prev[len_ts2]
+
+
+@njit(cache=True, parallel=True)
+def dtw_one_to_many_kernel(dissimilarity_code, row_lo, row_hi, query, candidates):
+    distances = np.empty(candidates.shape[0], query.dtype)
+    for k in prange(candidates.shape[0]):
+        distances[k] = _dtw_rolling_rows(dissimilarity_code, row_lo, row_hi, query, candidates[k])
+    return distances
+
+
+def dtw_one_to_many(query, candidates, local_dissimilarity="norm2", constrained_path_search=None,
+                    sakoe_chiba_radius=None, itakura_max_slope=None, n_threads=-1, dtype="float64"):
+    """
+    Dependent DTW distances between one query and many candidates of the same shape,
+    computed in a single parallel kernel. The query conversion and the constraint region
+    are computed once for all the candidates, and no mask nor cost matrix is built.
+
+    Parameters
+    ------------
+    :param query: time serie (T1) or (T1 x F)
+    :param candidates: array of time series (N x T2) or (N x T2 x F)
+    :param local_dissimilarity: "norm1", "norm2" or "square_euclidean_distance"
+    :param constrained_path_search: type constraint (None, sakoe-chiba o itakura)
+    :param sakoe_chiba_radius: int or None
+    :param itakura_max_slope: float or None
+    :param n_threads: number of threads (-1: all the numba threads)
+    :param dtype: "float64" or "float32"
+
+    :return: numpy.ndarray (N)
+        DTW distance between the query and each candidate
+    """
+    query = to_time_series(query, dtype)
+    candidates = np.asarray(candidates, dtype=dtype)
+    if candidates.ndim == 2:
+        candidates = candidates[:, :, np.newaxis]
+    candidates = np.ascontiguousarray(candidates)
+
+    row_lo, row_hi = constraint_row_bounds(query.shape[0], candidates.shape[1], constrained_path_search,
+                                           sakoe_chiba_radius, itakura_max_slope)
+
+    threads = numba.get_num_threads()
+    numba.set_num_threads(min(effective_n_jobs(n_threads), numba.config.NUMBA_NUM_THREADS))
+    try:
+        return dtw_one_to_many_kernel(LOCAL_DISSIMILARITY_CODE[local_dissimilarity], row_lo, row_hi,
+                                      query, candidates)
+    finally:
+        numba.set_num_threads(threads)
+
+
+# Explicit signatures of the compiled kernels for C-contiguous data. The kernel has a
+# float32 variant (dtype="float32") that keeps series and cost matrix in single precision.
+KERNEL_SIGNATURES = {
+    "dtw_kernel": ["float64[:, ::1](int64, float64[:, ::1], int64, int64, float64[:, ::1], float64[:, ::1], float64[:, ::1])",
+                   "float32[:, ::1](int64, float64[:, ::1], int64, int64, float32[:, ::1], float32[:, ::1], float32[:, ::1])"],
+    "dtw_wavefront_kernel": ["float64(int64, int64[::1], int64[::1], float64[:, ::1], float64[:, ::1])",
+                             "float64(int64, int64[::1], int64[::1], float32[:, ::1], float32[:, ::1])"],
+    "_dtw_rolling_rows": ["float64(int64, int64[::1], int64[::1], float64[:, ::1], float64[:, ::1])",
+                          "float32(int64, int64[::1], int64[::1], float32[:, ::1], float32[:, ::1])"],
+    "dtw_one_to_many_kernel": ["float64[::1](int64, int64[::1], int64[::1], float64[:, ::1], float64[:, :, ::1])",
+                               "float32[::1](int64, int64[::1], int64[::1], float32[:, ::1], float32[:, :, ::1])"],
+    "sakoe_chiba_mask": ["float64[:, ::1](int64, int64, int64)"],
+    "_njit_itakura_mask": ["float64[:, ::1](int64, int64, float64)"],
+}
+
+
+def warm_up():
+    """
+    Compile the DTW kernels for the signatures in KERNEL_SIGNATURES. Kernels are cached
+    on disk (numba cache=True), so after the first process this only loads them; calling
+    it when a worker starts removes the compile latency from its first task. The kernels
+    of the warping paths (warping_path) and of the visualization (get_path) are not
+    included: they are still compiled, or loaded, on first use.
+    """
+    for name, signatures in KERNEL_SIGNATURES.items():
+        kernel = globals()[name]
+        for signature in signatures:
+            kernel.compile(signature)
+
+
+def dtw_ind(ts1, ts2, local_dissimilarity, mask, dtw_distance=0, get_visualization=False, dtype="float64"):
     
     dim_m = ts1.shape[1]
     arr_cost_matrix = []
     len_ts1 = len(ts1)
     len_ts2 = len(ts2)
+    if mask.shape[0] < len_ts1 or mask.shape[1] < len_ts2:
+        raise ValueError('The mask ({} x {}) does not cover the series ({} x {}).'.format(
+            mask.shape[0], mask.shape[1], len_ts1, len_ts2))
 
     for index_m in range(dim_m):
         ts1_aux = ts1[:, index_m]
         ts2_aux = ts2[:, index_m]
 
-        cost_matrix = np.full((len_ts1+1, len_ts2+1), np.inf)
+        cost_matrix = np.full((len_ts1+1, len_ts2+1), np.inf, dtype=dtype)
         cost_matrix[0, 0] = 0.
 
         if local_dissimilarity in ["norm1", "norm2", "square_euclidean_distance"]:               
-            ts1_aux = to_time_series(ts1_aux)
-            ts2_aux = to_time_series(ts2_aux)
-            cost_matrix = general_dtw_ind(eval(local_dissimilarity), mask, len_ts1, len_ts2, ts1_aux, ts2_aux, cost_matrix)
+            ts1_aux = to_time_series(ts1_aux, dtype)
+            ts2_aux = to_time_series(ts2_aux, dtype)
+            cost_matrix = dtw_kernel(LOCAL_DISSIMILARITY_CODE[local_dissimilarity], mask, len_ts1, len_ts2, ts1_aux, ts2_aux, cost_matrix)
 
         elif local_dissimilarity == "gower":
+            import gower
             for i in range(len_ts1):
                 for j in range(len_ts2):
                     if np.isfinite(mask[i, j]):
@@ -322,40 +619,28 @@ def dtw_ind(ts1, ts2, local_dissimilarity, mask, dtw_distance=0, get_visualizati
 
         dtw_distance += cost_matrix[-1,-1]
 
+    # Sum of the per-feature cost matrices: a single matrix (and path) for the whole MTS.
     return dtw_distance, sum(arr_cost_matrix)
 
 
 
-@njit()
-def general_dtw_dep(local_dissimilarity, mask, len_ts1, len_ts2, ts1, ts2, cost_matrix):
-
-    for i in range(len_ts1):
-        for j in range(len_ts2):
-            if np.isfinite(mask[i, j]):
-                cost_matrix[i + 1, j + 1] = local_dissimilarity(ts1[i], ts2[j])
-                cost_matrix[i + 1, j + 1] += min(cost_matrix[i, j + 1],
-                                             cost_matrix[i + 1, j],
-                                             cost_matrix[i, j])
-    return cost_matrix
-
-
-
-def dtw_dep(ts1, ts2, local_dissimilarity, mask, mult_uts=False, regular_flag=0):
+def dtw_dep(ts1, ts2, local_dissimilarity, mask, mult_uts=False, regular_flag=0, dtype="float64"):
 
     len_ts1 = len(ts1)
     len_ts2 = len(ts2)
 
-    cost_matrix = np.full((len_ts1+1, len_ts2+1), np.inf)
+    cost_matrix = np.full((len_ts1+1, len_ts2+1), np.inf, dtype=dtype)
     cost_matrix[0, 0] = 0.
 
     if local_dissimilarity in ["norm1", "norm2", "square_euclidean_distance"]:
-        ts1 = to_time_series(ts1)
-        ts2 = to_time_series(ts2)
+        ts1 = to_time_series(ts1, dtype)
+        ts2 = to_time_series(ts2, dtype)
         #len_ts1 = ts1.shape[0]
         #len_ts2 = ts2.shape[0]
-        cost_matrix = general_dtw_dep(eval(local_dissimilarity), mask, len_ts1, len_ts2, ts1, ts2, cost_matrix)
+        cost_matrix = dtw_kernel(LOCAL_DISSIMILARITY_CODE[local_dissimilarity], mask, len_ts1, len_ts2, ts1, ts2, cost_matrix)
 
     elif local_dissimilarity == "gower":
+        import gower
         for i in range(len_ts1):
             for j in range(len_ts2):
                 if np.isfinite(mask[i, j]):
@@ -378,13 +663,51 @@ def dtw_dep(ts1, ts2, local_dissimilarity, mask, mult_uts=False, regular_flag=0)
 
     # irregular time series
     if regular_flag != 0:
-        return cost_matrix[-1,-1] / np.sqrt(len(ts1)*len(ts2)), cost_matrix
+        return cost_matrix.dtype.type(cost_matrix[-1,-1] / np.sqrt(len(ts1)*len(ts2))), cost_matrix
 
     return cost_matrix[-1,-1], cost_matrix
 
 
 
-def process_irregular_ts_dtw_ind(ts1, ts2, regular_flag):
+def valid_lengths(mts, regular_flag):
+    """
+    Number of valid time steps of each series of a tensor: the time steps with some value
+    other than regular_flag. Computed for the whole tensor at once.
+
+    Parameters
+    ------------
+    :param mts: tensor of N time series (N x T) or (N x T x F)
+    :param regular_flag: int value
+
+    :return: numpy.ndarray (N)
+        Valid length of each series
+    """
+    valid = np.asarray(mts) != regular_flag
+    return valid.reshape(valid.shape[0], valid.shape[1], -1).any(axis=2).sum(axis=1)
+
+
+def remove_regular_flag(ts1, ts2, regular_flag, lengths=None):
+    """
+    This function eliminates the values indicated in the flag, obtaining the irregular
+    time series as views of the first valid time steps.
+
+    Parameters
+    ------------
+    :param ts1: time serie 1
+    :param ts2: time serie 2
+    :param regular_flag: int value
+    :param lengths: valid lengths of ts1 and ts2, if already known (see valid_lengths)
+
+    :return: time serie 1 and time serie 2
+    """
+    ts1, ts2 = np.asanyarray(ts1), np.asanyarray(ts2)
+    if lengths is None:
+        lengths = valid_lengths(ts1[np.newaxis], regular_flag)[0], valid_lengths(ts2[np.newaxis], regular_flag)[0]
+
+    return ts1[0:lengths[0]], ts2[0:lengths[1]]
+
+
+def process_irregular_ts_dtw_ind(ts1, ts2, regular_flag, lengths=None):
     """
     This function eliminates the values indicated in the flag, obtaining irregular multivariate time series. After this, we replicate the last value of the time series (TS) until we obtain a regular TS.
 
@@ -393,28 +716,18 @@ def process_irregular_ts_dtw_ind(ts1, ts2, regular_flag):
     :param ts1: time serie 1
     :param ts2: time serie 2
     :param regular_flag: int value
+    :param lengths: valid lengths of ts1 and ts2, if already known (see valid_lengths)
 
     :return: time serie 1 and time serie 2
     """
 
-    ts1 = ts1[0:len(np.unique(np.where(ts1 != regular_flag)[0]))]
-    ts2 = ts2[0:len(np.unique(np.where(ts2 != regular_flag)[0]))]
+    ts1, ts2 = remove_regular_flag(ts1, ts2, regular_flag, lengths)
 
+    # The last time step is repeated in a single copy.
     if ts1.shape[0] < ts2.shape[0]:
-        ts1_aux = ts1.copy()
-        if ts1.shape[0] > 1:
-            ts1_aux = ts1[-1].reshape((1,-1))
-        
-        for _ in range(ts2.shape[0] - ts1.shape[0]):
-            ts1 = np.concatenate((ts1, ts1_aux))
-
+        ts1 = np.concatenate((ts1, np.repeat(ts1[-1:], ts2.shape[0] - ts1.shape[0], axis=0)))
     elif ts2.shape[0] < ts1.shape[0]:
-        ts2_aux = ts2.copy()
-        if ts2.shape[0] > 1:
-            ts2_aux = ts2[-1].reshape((1,-1))
-
-        for _ in range(ts1.shape[0] - ts2.shape[0]):
-            ts2 = np.concatenate((ts2, ts2_aux))
+        ts2 = np.concatenate((ts2, np.repeat(ts2[-1:], ts1.shape[0] - ts2.shape[0], axis=0)))
 
     return ts1, ts2
 
@@ -449,26 +762,52 @@ def get_mask(ts1, ts2, constrained_path_search, sakoe_chiba_radius, itakura_max_
 
 
 
-def dtw(ts1, ts2=None, type_dtw="d", constrained_path_search=None, local_dissimilarity=distance.euclidean, MTS=False, get_visualization=False, check_errors=False, regular_flag=0, n_threads=-1, dtw_to_kernel=False, sigma_kernel=1, itakura_max_slope=None, sakoe_chiba_radius=None, term_exec=False):
+def use_wavefront(ts1, ts2, type_dtw, local_dissimilarity, MTS, get_visualization, regular_flag, term_exec):
+    """
+    Whether dtw() computes a pair with the wavefront kernel: a single pair (2 UTS or
+    dependent MTS) of at least WAVEFRONT_MIN_CELLS cells, a compiled local
+    dissimilarity and neither visualization nor irregular series.
+    """
+    if ts2 is None or get_visualization or regular_flag != 0 or (MTS and type_dtw == "i"):
+        return False
+    if not isinstance(local_dissimilarity, str) or local_dissimilarity not in LOCAL_DISSIMILARITY_CODE:
+        return False
+    if isinstance(ts1, pd.DataFrame) or isinstance(ts2, pd.DataFrame):
+        return False
+    if not MTS and np.ndim(ts1) > 1 and not term_exec:
+        return False
+    return len(ts1) * len(ts2) >= WAVEFRONT_MIN_CELLS
+
+
+def dtw(ts1, ts2=None, type_dtw="d", constrained_path_search=None, local_dissimilarity=distance.euclidean, MTS=False, get_visualization=False, check_errors=False, regular_flag=0, n_threads=-1, dtw_to_kernel=False, sigma_kernel=1, itakura_max_slope=None, sakoe_chiba_radius=None, term_exec=False, dtype="float64", lengths=None):
 
     if check_errors:
         control_inputs(ts1, ts2, type_dtw, MTS, term_exec)
 
+    # Long pair and only the distance is needed: wavefront kernel, which neither builds
+    # the mask nor the cost matrix.
+    if use_wavefront(ts1, ts2, type_dtw, local_dissimilarity, MTS, get_visualization, regular_flag, term_exec):
+        return dtw_wavefront(ts1, ts2, local_dissimilarity, constrained_path_search,
+                             sakoe_chiba_radius, itakura_max_slope, dtype)
+
     mask = get_mask(ts1, ts2, constrained_path_search, sakoe_chiba_radius, itakura_max_slope)
     
     if MTS:        
         if type_dtw == "i":
 
             if regular_flag != 0:
-                ts1, ts2 = process_irregular_ts_dtw_ind(ts1, ts2, regular_flag)
+                ts1, ts2 = process_irregular_ts_dtw_ind(ts1, ts2, regular_flag, lengths)
+                # Series without padding (e.g. of a RaggedTensor) are now longer than the
+                # mask of their original lengths.
+                if mask.shape[0] < len(ts1) or mask.shape[1] < len(ts2):
+                    mask = get_mask(ts1, ts2, constrained_path_search, sakoe_chiba_radius, itakura_max_slope)
 
-            dtw_distance, cost_matrix = dtw_ind(ts1, ts2, local_dissimilarity, mask,  get_visualization=get_visualization)
+            dtw_distance, cost_matrix = dtw_ind(ts1, ts2, local_dissimilarity, mask,  get_visualization=get_visualization, dtype=dtype)
         else:
             if regular_flag != 0:
-                ts1 = ts1[0:len(np.unique(np.where(ts1 != regular_flag)[0]))]
-                ts2 = ts2[0:len(np.unique(np.where(ts2 != regular_flag)[0]))]
+                ts1, ts2 = remove_regular_flag(ts1, ts2, regular_flag, lengths)
 
-            dtw_distance, cost_matrix = dtw_dep(ts1, ts2, local_dissimilarity, mask, regular_flag=regular_flag)
+            dtw_distance, cost_matrix = dtw_dep(ts1, ts2, local_dissimilarity, mask, regular_flag=regular_flag, dtype=dtype)
     else:
         # In case of having N UTS. We parallelize
         ## Data matrix (UTS) introduced in dataframe format
@@ -477,19 +816,19 @@ def dtw(ts1, ts2=None, type_dtw="d", constrained_path_search=None, local_dissimi
                 ts2 = ts1.copy()
 
             dtw_matrix_train = Parallel(n_jobs=n_threads)(
-                delayed(dtw_dep)(ts1.loc[index_1,:].values, ts2.loc[index_2, :].values, local_dissimilarity, mask=get_mask(ts1.loc[index_1,:].values, ts2.loc[index_1,:].values, constrained_path_search, sakoe_chiba_radius, itakura_max_slope), mult_uts=True)
+                delayed(dtw_dep)(ts1.loc[index_1,:].values, ts2.loc[index_2, :].values, local_dissimilarity, mask=get_mask(ts1.loc[index_1,:].values, ts2.loc[index_1,:].values, constrained_path_search, sakoe_chiba_radius, itakura_max_slope), mult_uts=True, dtype=dtype)
                 for index_1 in range(ts1.shape[0])
                 for index_2 in range(ts2.shape[0])
             )
 
-            dtw_distance = np.array(dtw_matrix_train).reshape((len(ts1), len(ts2)))
+            dtw_distance = np.array(dtw_matrix_train, dtype=dtype).reshape((len(ts1), len(ts2)))
 
             if dtw_to_kernel:
                 return dtw_distance, transform_dtw_to_kernel(dtw_distance, sigma_kernel)
 
         # In case we have a unidimensional UTS with dataframe format.
         elif isinstance(ts1, pd.DataFrame) and ts1.shape[0] == 1:
-            dtw_distance, cost_matrix = dtw_dep(ts1, ts2, local_dissimilarity, mask)
+            dtw_distance, cost_matrix = dtw_dep(ts1, ts2, local_dissimilarity, mask, dtype=dtype)
         
         # If we hace a data matrix (UTS) introduced in array format with N UTS >= 2.
         else:
@@ -501,39 +840,34 @@ def dtw(ts1, ts2=None, type_dtw="d", constrained_path_search=None, local_dissimi
                 len_ts2 = len(ts2)
                 
                 dtw_matrix_train = Parallel(n_jobs=n_threads)(
-                    delayed(dtw_dep)(ts1[index_1], ts2[index_2], local_dissimilarity, mask=get_mask(ts1[index_1], ts2[index_1], constrained_path_search, sakoe_chiba_radius, itakura_max_slope), mult_uts=True)
+                    delayed(dtw_dep)(ts1[index_1], ts2[index_2], local_dissimilarity, mask=get_mask(ts1[index_1], ts2[index_1], constrained_path_search, sakoe_chiba_radius, itakura_max_slope), mult_uts=True, dtype=dtype)
                     for index_1 in range(len_ts1) 
                     for index_2 in range(len_ts2)
                 )
 
-                dtw_distance = np.array(dtw_matrix_train).reshape((len_ts1, len_ts2))
+                dtw_distance = np.array(dtw_matrix_train, dtype=dtype).reshape((len_ts1, len_ts2))
 
                 if dtw_to_kernel:
                     return dtw_distance, transform_dtw_to_kernel(dtw_distance, sigma_kernel)
 
             # In case of having 2 UTS.
             else:
-                dtw_distance, cost_matrix = dtw_dep(ts1, ts2, local_dissimilarity, mask)
+                dtw_distance, cost_matrix = dtw_dep(ts1, ts2, local_dissimilarity, mask, dtype=dtype)
 
 
     if get_visualization and not MTS:
-        if type_dtw == "i":
-            for i in range(len(cost_matrix)):
-                path = uv.get_path(cost_matrix[i])
-                uv.plot_cost_matrix(path, cost_matrix[i])
-                if not MTS:
-                    uv.plot_alignment(ts1, ts2, path)
-        else:
-            path = uv.get_path(cost_matrix)
-            uv.plot_cost_matrix(path, cost_matrix)
-            if not MTS:
-                uv.plot_alignment(ts1, ts2, path)
+        # Imported here so that matplotlib/seaborn are only loaded when plotting.
+        import utils_visualizations as uv
+
+        path = uv.get_path(cost_matrix)
+        uv.plot_cost_matrix(path, cost_matrix)
+        uv.plot_alignment(ts1, ts2, path)
 
 
     return dtw_distance
 
 
-def transform_dtw_to_kernel(data, sigma_kernel):
+def transform_dtw_to_kernel(data, sigma_kernel, out=None):
     """
     We transform the DTW matrix to an exponential kernel.
 
@@ -541,41 +875,168 @@ def transform_dtw_to_kernel(data, sigma_kernel):
     ------------
     :param data: numpy.ndarray
         DTW distance matrix
-    :param sigma_kernel: float
+    :param sigma_kernel: float, or sequence of S floats for one kernel per value
+    :param out: optional array where the kernel is written, of the shape of data (or
+        S x data.shape); data itself transforms the matrix in place
 
     :return: numpy.ndarray
         Transformation of the DTW distance matrix to exponential kernel.
     """
-	
-    return np.exp(-data/(2*sigma_kernel**2))
-	
+    if np.ndim(sigma_kernel) == 0:
+        out = np.divide(data, -2 * sigma_kernel**2, out=out)
+        return np.exp(out, out=out if isinstance(out, np.ndarray) else None)
+
+    data = np.asarray(data)
+    if out is None:
+        out = np.empty((len(sigma_kernel),) + data.shape, dtype=np.result_type(data.dtype, np.float32))
+    for kernel, sigma in zip(out, sigma_kernel):
+        transform_dtw_to_kernel(data, sigma, out=kernel)
+    return out
+
+
+# Pairs computed per row block by dtw_tensor_3d_blocks when block_rows is not given.
+BLOCK_PAIRS = 4096
+
+
+def series_lengths(mts):
+    """
+    Length of each series of a tensor (N x T x F), RaggedTensor or list of series.
+    """
+    if isinstance(mts, RaggedTensor):
+        return mts.lengths
+    if isinstance(mts, np.ndarray):
+        return np.full(len(mts), mts.shape[1] if mts.ndim > 1 else 1, dtype=np.int64)
+    return np.array([len(ts) for ts in mts], dtype=np.int64)
+
+
+def _dtw_chunk(pairs, options):
+    return [dtw(ts1, ts2, lengths=lengths, **options) for ts1, ts2, lengths in pairs]
+
+
+def dtw_tensor_3d_blocks(mts1, mts2, input_obj, block_rows=None, report=None):
+    """
+    Row blocks of the DTW matrix between two tensors, in order. The blocks can be written
+    out while the following ones are computed; the worker pool is shared by all of them.
 
-def dtw_tensor_3d(mts1, mts2, input_obj):
+    The pairs of each block are packed into chunks of similar estimated cost (lengths and
+    area of the global constraint), which are dispatched from the heaviest to the lightest.
+
+    Parameters
+    ------------
+    :param mts1: tensor of N MTS or RaggedTensor.
+    :param mts2: Another tensor of N MTS or RaggedTensor.
+    :param input_obj: object with parameters.
+    :param block_rows: number of rows per block (default: about BLOCK_PAIRS pairs per block).
+    :param report: optional scheduling.ScheduleReport filled with the worker utilization.
+
+    :return: generator of (int, numpy.ndarray)
+        Index of the first row of the block and the block of DTW distances.
+    """
+    n_rows, n_cols = len(mts1), len(mts2)
+    dtype = getattr(input_obj, "dtype", "float64")
+    if block_rows is None:
+        block_rows = max(1, BLOCK_PAIRS // max(n_cols, 1))
+
+    # Valid lengths of the irregular series, computed once for each tensor.
+    lengths1 = lengths2 = None
+    ragged = isinstance(mts1, RaggedTensor) or isinstance(mts2, RaggedTensor)
+    if input_obj.regular_flag != 0 and input_obj.MTS and not ragged:
+        lengths1 = valid_lengths(mts1, input_obj.regular_flag)
+        lengths2 = lengths1 if mts2 is mts1 else valid_lengths(mts2, input_obj.regular_flag)
+
+    # The costs are estimated block by block: the full N x M matrix is never built.
+    cost_lengths1 = series_lengths(mts1) if lengths1 is None else lengths1
+    cost_lengths2 = series_lengths(mts2) if lengths2 is None else lengths2
+
+    options = dict(type_dtw=input_obj.type_dtw, constrained_path_search=input_obj.constrained_path_search,
+                   local_dissimilarity=input_obj.local_dissimilarity, MTS=input_obj.MTS,
+                   get_visualization=input_obj.visualization, check_errors=input_obj.check_errors,
+                   regular_flag=input_obj.regular_flag, itakura_max_slope=input_obj.itakura_max_slope,
+                   sakoe_chiba_radius=input_obj.sakoe_chiba_radius, dtype=dtype)
+
+    n_workers = effective_n_jobs(input_obj.n_threads)
+    if report is not None:
+        report.n_workers = n_workers
+
+    with Parallel(n_jobs=input_obj.n_threads, batch_size=1) as parallel:
+        for start in range(0, n_rows, block_rows):
+            stop = min(start + block_rows, n_rows)
+            pairs = [(i, j) for i in range(start, stop) for j in range(n_cols)]
+            costs = pair_costs(cost_lengths1[start:stop], cost_lengths2, input_obj.constrained_path_search,
+                               input_obj.sakoe_chiba_radius, input_obj.itakura_max_slope)
+            chunks = balanced_chunks(costs.ravel(), CHUNKS_PER_WORKER * n_workers)
+
+            began = time.perf_counter()
+            results = parallel(
+                delayed(timed)(_dtw_chunk,
+                               [(mts1[i], mts2[j], None if lengths1 is None else (lengths1[i], lengths2[j]))
+                                for i, j in (pairs[k] for k in chunk)],
+                               options)
+                for chunk, _ in chunks
+            )
+            wall_time = time.perf_counter() - began
+
+            block = np.empty(len(pairs), dtype=dtype)
+            for (chunk, _), (distances, _) in zip(chunks, results):
+                block[chunk] = distances
+            if report is not None:
+                report.add(len(pairs), [load for _, load in chunks], [busy for _, busy in results], wall_time)
+            yield start, block.reshape((stop - start, n_cols))
+
+
+def dtw_tensor_3d(mts1, mts2, input_obj, report=None):
     """
     Function to obtain the calculation of the DTW distance at a high level. Parallelization is included.
 
     Parameters
     ------------
-    :param mts1: tensor of N MTS.
-    :param mts2: Another tensor of N MTS.
+    :param mts1: tensor of N MTS or RaggedTensor.
+    :param mts2: Another tensor of N MTS or RaggedTensor.
     :param input_obj: object with parameters.
+    :param report: optional scheduling.ScheduleReport filled with the worker utilization.
 
     :return: numpy.ndarray
         DTW matrix or matrix kernel.
     """
 
-    dtw_matrix_train = Parallel(n_jobs=input_obj.n_threads)(
-        delayed(dtw)(mts1[i], mts2[j], type_dtw=input_obj.type_dtw, constrained_path_search=input_obj.constrained_path_search, local_dissimilarity=input_obj.local_dissimilarity,
-                      MTS=input_obj.MTS, get_visualization=input_obj.visualization,
-                      check_errors=input_obj.check_errors, regular_flag=input_obj.regular_flag,
-                      itakura_max_slope=input_obj.itakura_max_slope, sakoe_chiba_radius=input_obj.sakoe_chiba_radius)
-        for i in range(mts1.shape[0])
-        for j in range(mts2.shape[0])
-    )
-    
-    data = np.array(dtw_matrix_train).reshape((mts1.shape[0], mts2.shape[0]))
-
+    data = np.empty((len(mts1), len(mts2)), dtype=getattr(input_obj, "dtype", "float64"))
+    # The kernel is filled block by block, without temporaries of the size of the matrix.
+    kernel = None
     if input_obj.dtw_to_kernel:
-        return data, transform_dtw_to_kernel(data, input_obj.sigma_kernel)
+        kernel = np.empty(np.shape(input_obj.sigma_kernel) + data.shape, dtype=data.dtype)
+    for start, block in dtw_tensor_3d_blocks(mts1, mts2, input_obj, report=report):
+        rows = slice(start, start + block.shape[0])
+        data[rows] = block
+        if kernel is not None:
+            transform_dtw_to_kernel(block, input_obj.sigma_kernel, out=kernel[..., rows, :])
 
-    return data
\ No newline at end of file
+    if kernel is not None:
+        return data, kernel
+
+    return data
+
+
+def dtw_gram_matrix(mts1, mts2, input_obj, sigma_kernel=None, out=None, report=None):
+    """
+    Gram matrix of the exponential DTW kernel between two tensors, computed block by
+    block: the DTW distance matrix is never held in memory, and all the values of sigma
+    share the same DTW computations (e.g. to search the sigma of an SVM).
+
+    Parameters
+    ------------
+    :param mts1: tensor of N MTS or RaggedTensor.
+    :param mts2: Another tensor of M MTS or RaggedTensor.
+    :param input_obj: object with parameters.
+    :param sigma_kernel: float or sequence of S floats (default: input_obj.sigma_kernel).
+    :param out: optional array (e.g. a numpy.memmap) of shape (N x M), or (S x N x M).
+    :param report: optional scheduling.ScheduleReport filled with the worker utilization.
+
+    :return: numpy.ndarray
+        Kernel matrix (N x M), or one per value of sigma (S x N x M).
+    """
+    sigma_kernel = input_obj.sigma_kernel if sigma_kernel is None else sigma_kernel
+    if out is None:
+        out = np.empty(np.shape(sigma_kernel) + (len(mts1), len(mts2)), dtype=getattr(input_obj, "dtype", "float64"))
+    for start, block in dtw_tensor_3d_blocks(mts1, mts2, input_obj, report=report):
+        transform_dtw_to_kernel(block, sigma_kernel, out=out[..., start:start + block.shape[0], :])
+    return out
@@ -1,8 +1,7 @@
 # File error control of input
 import numpy as np
 from scipy.spatial import distance
-import io
-from contextlib import redirect_stdout
+from functools import lru_cache
 
 def control_inputs(x, y, type_dtw, MTS, term_exec):
 
@@ -31,42 +30,31 @@ def control_inputs(x, y, type_dtw, MTS, term_exec):
 
 
 
-# Functions to obtain the possible distances to be managed. 
+# Possible distances to be managed. The scipy.spatial.distance dissimilarities are kept
+# in a static registry (instead of introspecting the module on every call), filtered
+# once by the ones available in the installed SciPy release.
+
+SCIPY_DISTANCES = (
+    "braycurtis", "canberra", "chebyshev", "cityblock", "correlation", "cosine",
+    "dice", "euclidean", "hamming", "jaccard", "jensenshannon", "kulczynski1",
+    "kulsinski", "mahalanobis", "minkowski", "rogerstanimoto", "russellrao",
+    "seuclidean", "sokalmichener", "sokalsneath", "sqeuclidean", "wminkowski", "yule",
+)
+
+# Gower distance allows the calculation of distance between continuous and binary variables.
+# norm1, norm2 and square_euclidean_distance are optimized in terms of computational time.
+DTW_DISTANCES = ("gower", "norm1", "norm2", "square_euclidean_distance")
+
+
+@lru_cache(maxsize=None)
+def _registered_distances():
+    return tuple(name for name in SCIPY_DISTANCES if hasattr(distance, name)) + DTW_DISTANCES
+
 
-def is_distance_function(func, checker):
-    """
-    Function that allows to check if the distance passed is inside a library, in this case, inside scipy.distance.
-    """
-    with io.StringIO() as buf, redirect_stdout(buf):
-        help(func)
-        output = buf.getvalue()
-
-    if output.split("\n")[0].find(checker) == -1:
-        return False
-    else:
-        return True
-        
-        
 def possible_distances():
     """
     Check that the parameter introduced by terminal associated to the distance is one of the possible parameters to use.
 
     :return: possible distances
     """
-    possible_distance = []
-    for i in range(len(dir(distance))):
-        if(len(dir(distance)[i].split("_")) == 1) and not any(c.isupper() for c in dir(distance)[i]):
-            if is_distance_function("scipy.spatial.distance."+dir(distance)[i],
-            checker = "function " + dir(distance)[i] + " in scipy.spatial.distance"):
-                possible_distance.append(dir(distance)[i])
-
-    # I add as a possible distance measurement the gower distance. Gower distance allows the
-    # calculation of distance between continuous and binary variables.
-    possible_distance.append("gower")
-    # I include the computation of norm 1 and norm 2 optimized in terms of computational time.
-    possible_distance.append("norm1")
-    possible_distance.append("norm2")
-    possible_distance.append("square_euclidean_distance")
-    
-    return possible_distance
-   
+    return list(_registered_distances())
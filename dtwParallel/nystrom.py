@@ -0,0 +1,133 @@
+import sys
+import os.path
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from dtw_functions import dtw_tensor_3d_blocks, transform_dtw_to_kernel
+from ragged import RaggedTensor
+
+# Nystrom approximation of the exponential DTW kernel from m landmark series. With C the
+# N x m kernel between the series and the landmarks and W the m x m kernel between the
+# landmarks,
+#
+#     K ~ C W^+ C^T = F F^T,   F = C U diag(lambda)^(-1/2)   (W = U diag(lambda) U^T),
+#
+# so a linear model on the N x r features F (r <= m) approximates a kernel machine on K.
+# Only the N x m DTW distances are computed (W is the block of C of the landmark rows):
+# O(N m) DTW evaluations instead of O(N^2). The distances are kept, so the features for
+# other values of sigma need no DTW computation.
+
+NYSTROM_LANDMARKS = 256
+
+
+def _subset(X, indices):
+    if isinstance(X, np.ndarray):
+        return X[indices]
+    if isinstance(X, RaggedTensor):
+        return RaggedTensor.from_series([X[i] for i in indices], X.values.dtype)
+    return [X[i] for i in indices]
+
+
+def select_landmarks(X, n_landmarks, method="random", input_obj=None, seed=0):
+    """
+    Indices of n_landmarks representative series.
+
+    :param X: tensor of N MTS, RaggedTensor or list of series
+    :param n_landmarks: number of landmarks
+    :param method: "random" (uniform sample) or "kmedoids" (CLARA medoids, which costs
+        about (40 + 2m)**2 / 2 + N m additional DTW distances)
+    :param input_obj: object with parameters (used by "kmedoids")
+    :param seed: seed of the random selection
+    :return: numpy.ndarray
+    """
+    n_landmarks = min(n_landmarks, len(X))
+    if method == "random":
+        return np.sort(np.random.default_rng(seed).choice(len(X), size=n_landmarks, replace=False))
+    if method == "kmedoids":
+        from clustering import k_medoids
+
+        medoids, _, _ = k_medoids(X, n_landmarks, method="clara", n_samples=1, seed=seed,
+                                  type_dtw=input_obj.type_dtw, local_dissimilarity=input_obj.local_dissimilarity,
+                                  constrained_path_search=input_obj.constrained_path_search,
+                                  sakoe_chiba_radius=input_obj.sakoe_chiba_radius,
+                                  itakura_max_slope=input_obj.itakura_max_slope, n_threads=input_obj.n_threads,
+                                  dtype=getattr(input_obj, "dtype", "float64"))
+        return np.sort(medoids)
+    raise ValueError('The landmark selection must be "random" or "kmedoids".')
+
+
+class NystromKernel:
+    """
+    Low-rank factor F (N x r) of the exponential DTW kernel, K ~ F F^T, computed from the
+    DTW distances to m landmark series.
+
+        nystrom = NystromKernel(input_obj, n_landmarks=500).fit(X)
+        F_train = nystrom.features(sigma_kernel=1)
+        F_test = nystrom.transform(X_test, sigma_kernel=1)
+    """
+    def __init__(self, input_obj, n_landmarks=NYSTROM_LANDMARKS, landmarks="random", seed=0, rcond=1e-10):
+        """
+        :param input_obj: object with parameters (as for dtw_tensor_3d); its sigma_kernel
+            is the default value of sigma
+        :param n_landmarks: number of landmarks m
+        :param landmarks: "random", "kmedoids" or the indices of the landmarks
+        :param seed: seed of the landmark selection
+        :param rcond: eigenvalues of W below rcond times the largest are discarded
+        """
+        self.input_obj = input_obj
+        self.n_landmarks = n_landmarks
+        self.landmarks = landmarks
+        self.seed = seed
+        self.rcond = rcond
+
+    def _distances(self, X, report=None):
+        data = np.empty((len(X), len(self.landmark_indices)), dtype=getattr(self.input_obj, "dtype", "float64"))
+        for start, block in dtw_tensor_3d_blocks(X, self.landmark_series, self.input_obj, report=report):
+            data[start:start + block.shape[0]] = block
+        return data
+
+    def fit(self, X, report=None):
+        """
+        Select the landmarks and compute the DTW distances of the N series to them.
+
+        :param X: tensor of N MTS, RaggedTensor or list of series
+        :param report: optional scheduling.ScheduleReport
+        :return: self
+        """
+        if isinstance(self.landmarks, str):
+            self.landmark_indices = select_landmarks(X, self.n_landmarks, self.landmarks, self.input_obj, self.seed)
+        else:
+            self.landmark_indices = np.asarray(self.landmarks, dtype=np.int64)
+        self.landmark_series = _subset(X, self.landmark_indices)
+        self.distances = self._distances(X, report)
+        return self
+
+    def normalization(self, sigma_kernel=None):
+        """
+        U diag(lambda)^(-1/2) (m x r) of the landmark kernel W for a value of sigma.
+        """
+        sigma_kernel = self.input_obj.sigma_kernel if sigma_kernel is None else sigma_kernel
+        landmark_distances = self.distances[self.landmark_indices]
+        W = transform_dtw_to_kernel((landmark_distances + landmark_distances.T) / 2, sigma_kernel)
+        eigenvalues, eigenvectors = np.linalg.eigh(W)
+        keep = eigenvalues > self.rcond * eigenvalues.max()
+        return eigenvectors[:, keep] / np.sqrt(eigenvalues[keep])
+
+    def features(self, sigma_kernel=None):
+        """
+        Nystrom features of the fitted series (N x r), without any DTW computation.
+        """
+        kernel = transform_dtw_to_kernel(self.distances,
+                                         self.input_obj.sigma_kernel if sigma_kernel is None else sigma_kernel)
+        return kernel @ self.normalization(sigma_kernel)
+
+    def transform(self, Y, sigma_kernel=None, report=None):
+        """
+        Nystrom features of other series (len(Y) x r), from their DTW distances to the
+        landmarks.
+        """
+        kernel = transform_dtw_to_kernel(self._distances(Y, report),
+                                         self.input_obj.sigma_kernel if sigma_kernel is None else sigma_kernel)
+        return kernel @ self.normalization(sigma_kernel)
@@ -0,0 +1,96 @@
+import os.path
+import zipfile
+
+import numpy as np
+from numpy.lib.format import open_memmap, write_array_header_1_0
+
+# Writers that receive a distance matrix as row blocks, in order, while the rest of the
+# matrix is still being computed. They all follow the same protocol:
+#
+#     writer = open_writer(path, shape)
+#     for start, block in blocks:
+#         writer.write(start, block)
+#     writer.close()
+#
+# The format is taken from the extension of the path: .npy (memory-mapped), .npz
+# (compressed) or .csv (the default when the path has no known extension).
+
+OUTPUT_FORMATS = ('.npy', '.npz', '.csv')
+
+
+class NpyWriter:
+    """
+    .npy file mapped in memory: each block is copied to its rows and paged out by the OS.
+    """
+    def __init__(self, path, shape, dtype=np.float64):
+        self.path = path
+        self.data = open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def write(self, start, block):
+        self.data[start:start + block.shape[0]] = block
+
+    def close(self):
+        self.data.flush()
+        del self.data
+
+
+class NpzWriter:
+    """
+    Compressed .npz file (np.load compatible) with a single array named `name`. The .npy
+    member is deflated as the rows arrive, so the whole matrix is never held in memory.
+    """
+    def __init__(self, path, shape, dtype=np.float64, name='distance'):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.zip = zipfile.ZipFile(path, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.member = self.zip.open(name + '.npy', mode='w', force_zip64=True)
+        write_array_header_1_0(self.member, {'descr': np.lib.format.dtype_to_descr(self.dtype),
+                                             'fortran_order': False,
+                                             'shape': tuple(shape)})
+
+    def write(self, start, block):
+        self.member.write(np.ascontiguousarray(block, dtype=self.dtype).tobytes())
+
+    def close(self):
+        self.member.close()
+        self.zip.close()
+
+
+class CsvWriter:
+    """
+    CSV file with a header of column indices, as written by pandas, and the rows
+    formatted with '%g' one block at a time. dtype is ignored: the values are written
+    as text.
+    """
+    def __init__(self, path, shape, dtype=np.float64):
+        self.path = path
+        self.file = open(path, 'w')
+        self.file.write(','.join(str(j) for j in range(shape[1])) + '\n')
+
+    def write(self, start, block):
+        np.savetxt(self.file, block, fmt='%g', delimiter=',')
+
+    def close(self):
+        self.file.close()
+
+
+_WRITERS = {'.npy': NpyWriter, '.npz': NpzWriter, '.csv': CsvWriter}
+
+
+def output_path(name_file, suffix=''):
+    """
+    Output path for name_file: kept as is if it has one of OUTPUT_FORMATS as extension,
+    otherwise written as CSV. The suffix is inserted before the extension.
+    """
+    root, extension = os.path.splitext(name_file)
+    if extension not in OUTPUT_FORMATS:
+        root, extension = name_file, '.csv'
+    return root + suffix + extension
+
+
+def open_writer(path, shape, dtype=np.float64):
+    """
+    Writer for a matrix of the given shape, chosen by the extension of path.
+    """
+    extension = os.path.splitext(path)[1]
+    return _WRITERS.get(extension, CsvWriter)(path, shape, dtype=dtype)
@@ -0,0 +1,113 @@
+import numpy as np
+
+# Variable-length time series without padding: the time steps of all the series are
+# stored one after another in a single buffer, and offsets[i]:offsets[i + 1] are the rows
+# of series i.
+#
+#     values:  (sum of lengths) x F
+#     offsets: N + 1, non-decreasing, offsets[0] = 0
+#
+# A RaggedTensor can be used wherever dtw_tensor_3d and the CLI take a 3D tensor; it is
+# saved to and loaded from .npz files with the arrays 'values' and 'offsets'.
+
+
+class RaggedTensor:
+    """
+    N time series of different lengths and F features stored as values plus offsets.
+    Indexing with an integer returns a view of one series (length x F); with a slice,
+    a RaggedTensor of the selected series.
+    """
+    def __init__(self, values, offsets):
+        values = np.asarray(values)
+        if values.ndim == 1:
+            values = values[:, np.newaxis]
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if offsets.ndim != 1 or len(offsets) == 0 or offsets[0] != 0 or np.any(np.diff(offsets) < 0) \
+                or offsets[-1] != values.shape[0]:
+            raise ValueError('Offsets must start at 0, be non-decreasing and end at the number of time steps.')
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_series(cls, series, dtype=np.float64):
+        """
+        RaggedTensor from a sequence of time series (T_i) or (T_i x F).
+        """
+        series = [np.asarray(ts, dtype=dtype) for ts in series]
+        series = [ts[:, np.newaxis] if ts.ndim == 1 else ts for ts in series]
+        offsets = np.concatenate(([0], np.cumsum([ts.shape[0] for ts in series], dtype=np.int64)))
+        if not series:
+            return cls(np.empty((0, 1), dtype=dtype), offsets)
+        return cls(np.concatenate(series), offsets)
+
+    @classmethod
+    def from_padded(cls, mts, regular_flag):
+        """
+        RaggedTensor from a tensor (N x T x F) whose series are completed with regular_flag.
+        """
+        from dtw_functions import valid_lengths
+
+        mts = np.asarray(mts)
+        if mts.ndim == 2:
+            mts = mts[:, :, np.newaxis]
+        lengths = valid_lengths(mts, regular_flag)
+        keep = np.arange(mts.shape[1]) < lengths[:, np.newaxis]
+        return cls(mts[keep], np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['values'], data['offsets'])
+
+    def save(self, path):
+        np.savez(path, values=self.values, offsets=self.offsets)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def n_features(self):
+        return self.values.shape[1]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return RaggedTensor.from_series([self[i] for i in range(start, stop, step)], self.values.dtype)
+            stop = max(start, stop)
+            return RaggedTensor(self.values[self.offsets[start]:self.offsets[stop]],
+                                self.offsets[start:stop + 1] - self.offsets[start])
+        index = range(len(self))[index]
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return 'RaggedTensor(n_series={}, n_features={})'.format(len(self), self.n_features)
+
+
+def as_ragged(X):
+    """
+    RaggedTensor of a tensor (N x T x F), RaggedTensor or list of series (T_i) or (T_i x F).
+    The values of a tensor are not copied.
+    """
+    if isinstance(X, RaggedTensor):
+        return X
+    if isinstance(X, np.ndarray) and X.ndim == 3:
+        return RaggedTensor(X.reshape(-1, X.shape[2]), np.arange(X.shape[0] + 1) * X.shape[1])
+    return RaggedTensor.from_series(X)
+
+
+def load_tensor(path):
+    """
+    Tensor of a .npy (N x T x F) or .npz (RaggedTensor) file.
+    """
+    if str(path).endswith('.npz'):
+        return RaggedTensor.load(path)
+    return np.load(path)
@@ -0,0 +1,161 @@
+import heapq
+import time
+from functools import lru_cache
+
+import numpy as np
+
+# Cost-aware scheduling of the pairs of a distance matrix. With series of different
+# lengths or a global constraint, the cost of a pair can differ by orders of magnitude,
+# and joblib's automatic batching (which only looks at the number of tasks) leaves
+# workers idle while one of them computes a batch of expensive pairs. Instead:
+#
+#   1. the cost of each pair is estimated as the number of cells of the cost matrix
+#      admitted by the global constraint (pair_costs);
+#   2. the pairs are packed into a few chunks per worker with the LPT rule (longest
+#      processing time first: each pair goes to the least loaded chunk) (balanced_chunks);
+#   3. the chunks are dispatched from the heaviest to the lightest, and the busy time of
+#      each one is collected in a ScheduleReport.
+
+CHUNKS_PER_WORKER = 4
+
+
+@lru_cache(maxsize=65536)
+def band_area(len_ts1, len_ts2, constrained_path_search=None, sakoe_chiba_radius=None, itakura_max_slope=None):
+    """
+    Number of cells of the (len_ts1 x len_ts2) cost matrix admitted by the global
+    constraint: the region of compute_mask, counted from its row bounds.
+    """
+    from dtw_functions import GLOBAL_CONSTRAINT_CODE, constraint_row_bounds
+
+    if GLOBAL_CONSTRAINT_CODE[constrained_path_search] == 0 and sakoe_chiba_radius is None \
+            and itakura_max_slope is None:
+        return len_ts1 * len_ts2
+    row_lo, row_hi = constraint_row_bounds(len_ts1, len_ts2, constrained_path_search,
+                                           sakoe_chiba_radius, itakura_max_slope)
+    return int((row_hi - row_lo).sum())
+
+
+def pair_costs(lengths1, lengths2, constrained_path_search=None, sakoe_chiba_radius=None, itakura_max_slope=None):
+    """
+    Estimated cost of every pair (i, j) of two sets of series with the given lengths.
+
+    :return: numpy.ndarray (len(lengths1) x len(lengths2))
+    """
+    lengths1 = np.asarray(lengths1, dtype=np.int64)
+    lengths2 = np.asarray(lengths2, dtype=np.int64)
+    unconstrained = np.outer(lengths1, lengths2)
+    if constrained_path_search is None and sakoe_chiba_radius is None and itakura_max_slope is None:
+        return unconstrained
+
+    # One band per distinct pair of lengths.
+    unique1, inverse1 = np.unique(lengths1, return_inverse=True)
+    unique2, inverse2 = np.unique(lengths2, return_inverse=True)
+    areas = np.array([[band_area(int(n), int(m), constrained_path_search, sakoe_chiba_radius, itakura_max_slope)
+                       for m in unique2] for n in unique1], dtype=np.int64).reshape(len(unique1), len(unique2))
+    # An empty band is still a task: the mask is built and the pair is visited.
+    return np.maximum(areas[np.ix_(inverse1, inverse2)], 1)
+
+
+def paired_costs(lengths1, lengths2, constrained_path_search=None, sakoe_chiba_radius=None, itakura_max_slope=None):
+    """
+    Estimated cost of the pairs of series with lengths (lengths1[k], lengths2[k]), for
+    lists of pairs that are not a full matrix.
+
+    :return: numpy.ndarray (len(lengths1))
+    """
+    lengths1 = np.asarray(lengths1, dtype=np.int64)
+    lengths2 = np.asarray(lengths2, dtype=np.int64)
+    if constrained_path_search is None and sakoe_chiba_radius is None and itakura_max_slope is None:
+        return lengths1 * lengths2
+
+    shapes, inverse = np.unique(np.column_stack((lengths1, lengths2)), axis=0, return_inverse=True)
+    areas = np.array([band_area(int(n), int(m), constrained_path_search, sakoe_chiba_radius, itakura_max_slope)
+                      for n, m in shapes], dtype=np.int64)
+    return np.maximum(areas[inverse.ravel()], 1)
+
+
+def balanced_chunks(costs, n_chunks):
+    """
+    Partition of the tasks into at most n_chunks chunks of similar total cost (LPT rule),
+    ordered from the heaviest chunk to the lightest one.
+
+    :param costs: estimated cost of each task
+    :param n_chunks: number of chunks
+    :return: list of (numpy.ndarray, float)
+        Indices of the tasks of each chunk and its total estimated cost.
+    """
+    costs = np.asarray(costs, dtype=np.float64)
+    n_chunks = max(1, min(int(n_chunks), len(costs)))
+    heap = [(0., chunk) for chunk in range(n_chunks)]
+    members = [[] for _ in range(n_chunks)]
+    for task in np.argsort(-costs, kind="stable"):
+        load, chunk = heapq.heappop(heap)
+        members[chunk].append(task)
+        heapq.heappush(heap, (load + costs[task], chunk))
+
+    loads = [load for load, _ in sorted(heap, key=lambda item: item[1])]
+    order = sorted(range(n_chunks), key=lambda chunk: -loads[chunk])
+    return [(np.array(members[chunk], dtype=np.int64), loads[chunk]) for chunk in order if members[chunk]]
+
+
+def timed(func, *args, **kwargs):
+    """
+    Result of func(*args, **kwargs) and the seconds it took, measured where it runs.
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+class ScheduleReport:
+    """
+    Utilization achieved by a parallel computation: busy time of every chunk against the
+    wall-clock time of the computation times the number of workers.
+    """
+    def __init__(self, n_workers=1):
+        self.n_workers = n_workers
+        self.n_tasks = 0
+        self.estimated_costs = []
+        self.busy_times = []
+        self.wall_time = 0.
+
+    def add(self, n_tasks, estimated_costs, busy_times, wall_time):
+        self.n_tasks += n_tasks
+        self.estimated_costs.extend(estimated_costs)
+        self.busy_times.extend(busy_times)
+        self.wall_time += wall_time
+
+    @property
+    def n_chunks(self):
+        return len(self.busy_times)
+
+    @property
+    def utilization(self):
+        """
+        Fraction of the available worker time spent computing (1.0: no worker idle).
+        """
+        if self.wall_time <= 0:
+            return 0.
+        return min(1., sum(self.busy_times) / (self.n_workers * self.wall_time))
+
+    @property
+    def imbalance(self):
+        """
+        Busy time of the slowest chunk over the mean busy time of a chunk.
+        """
+        if not self.busy_times or np.mean(self.busy_times) <= 0:
+            return 1.
+        return float(np.max(self.busy_times) / np.mean(self.busy_times))
+
+    def as_dict(self):
+        return {'workers': self.n_workers,
+                'tasks': self.n_tasks,
+                'chunks': self.n_chunks,
+                'busy_time': float(sum(self.busy_times)),
+                'wall_time': self.wall_time,
+                'utilization': self.utilization,
+                'imbalance': self.imbalance}
+
+    def __str__(self):
+        return ('{tasks} pairs in {chunks} chunks on {workers} workers: utilization {utilization:.1%}, '
+                'busy {busy_time:.3f} s, wall {wall_time:.3f} s, imbalance {imbalance:.2f}').format(**self.as_dict())
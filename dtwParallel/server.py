@@ -0,0 +1,273 @@
+import json
+import sys
+import os.path
+import signal
+import socketserver
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from joblib import effective_n_jobs
+from scipy.spatial import distance
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from batch import batch_options, load_series
+from dtw_functions import dtw, warm_up
+from error_control import possible_distances
+
+# Server mode: a long-running local service that keeps the compiled kernels, a pool of
+# worker processes and, optionally, a reference dataset in memory.
+#
+#     POST /distance  {"x": series, "y": series}                  -> {"distance": float}
+#     POST /matrix    {"X": [series, ...], "Y": [series, ...]}     -> {"matrix": [[float]]}
+#     POST /knn       {"x": series, "k": int}                      -> {"indices": [int], "distances": [float]}
+#     GET  /health                                                 -> {"status": "ok", "reference": shape}
+#
+# A series is a list (UTS), a list of lists (MTS, one row per time step) or an integer
+# index into the reference dataset. Paths to .npy/.csv files are only accepted when the
+# server is started with a data directory, and must be inside it. In /matrix, a missing X
+# stands for the reference dataset and a missing Y for X. Any DTW parameter of the command
+# line (type_dtw, local_dissimilarity, ...) can be overridden per request.
+#
+# Errors of a request are answered with status 400 and the message of a RequestError,
+# written for the client; other client errors (malformed JSON, missing fields, invalid
+# series) get a generic message. Any other error is a fault of the server (a crashed
+# worker, a broken pool) and is answered with status 500. The details only go to the log.
+
+# Reference dataset and data directory of the worker process, set by _init_worker.
+_reference = None
+_data_dir = None
+
+
+class RequestError(ValueError):
+    """
+    Invalid request, with a message that can be sent back to the client.
+    """
+
+
+def _init_worker(reference, data_dir=None):
+    global _reference, _data_dir
+    warm_up()
+    _data_dir = data_dir
+    if reference is not None:
+        _reference = np.load(reference, mmap_mode='r')
+
+
+def _data_path(value):
+    """
+    Path of a series file given in a request, which must be inside the data directory.
+    """
+    if _data_dir is None:
+        raise RequestError('Series paths are not accepted: give the series inline or as reference indices.')
+    path = os.path.realpath(os.path.join(_data_dir, value))
+    if os.path.commonpath([path, _data_dir]) != _data_dir:
+        raise RequestError('Series paths must be inside the data directory.')
+    return path
+
+
+def _series(value):
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        if _reference is None:
+            raise RequestError('The server was started without a reference dataset (-r).')
+        if not -len(_reference) <= value < len(_reference):
+            raise RequestError('Reference index {} out of range.'.format(int(value)))
+        return load_series(np.asarray(_reference[value], dtype=float))
+    if isinstance(value, str):
+        return load_series(_data_path(value))
+    return load_series(value)
+
+
+def _pair_distance(ts1, ts2, options):
+    return float(dtw(ts1, ts2, MTS=ts1.ndim > 1, **options))
+
+
+def _distance(x, y, options):
+    return _pair_distance(_series(x), _series(y), options)
+
+
+def _matrix_row(x, Y, options):
+    ts1 = _series(x)
+    if Y is None:
+        Y = range(len(_reference))
+    return [_pair_distance(ts1, _series(y), options) for y in Y]
+
+
+def _reference_distances(x, start, stop, options):
+    ts1 = _series(x)
+    return [_pair_distance(ts1, _series(index), options) for index in range(start, stop)]
+
+
+def resolve_options(defaults, request):
+    """
+    DTW parameters of a request: the server defaults updated with the request fields.
+    """
+    options = dict(defaults)
+    for key in defaults:
+        if key in request:
+            options[key] = request[key]
+
+    dissimilarity = options['local_dissimilarity']
+    if isinstance(dissimilarity, str) and dissimilarity not in ["gower", "norm1", "norm2", "square_euclidean_distance"]:
+        if dissimilarity not in possible_distances():
+            raise RequestError('Distance introduced not allowed or incorrect.')
+        options['local_dissimilarity'] = getattr(distance, dissimilarity)
+    return options
+
+
+class DTWService:
+    """
+    Worker pool and reference dataset shared by every request of the server.
+    """
+    def __init__(self, input_obj, reference=None, data_dir=None):
+        self.options = batch_options(input_obj)
+        self.n_workers = effective_n_jobs(input_obj.n_threads)
+        self.reference_shape = None
+        if reference is not None:
+            self.reference_shape = list(np.load(reference, mmap_mode='r').shape)
+        self.executor = ProcessPoolExecutor(max_workers=self.n_workers,
+                                            mp_context=mp.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(reference, None if data_dir is None
+                                                      else os.path.realpath(data_dir)))
+
+    def _require_reference(self):
+        if self.reference_shape is None:
+            raise RequestError('The server was started without a reference dataset (-r).')
+
+    def distance(self, request):
+        options = resolve_options(self.options, request)
+        return {'distance': self.executor.submit(_distance, request['x'], request['y'], options).result()}
+
+    def matrix(self, request):
+        options = resolve_options(self.options, request)
+        X = request.get('X')
+        Y = request.get('Y')
+        if X is None:
+            self._require_reference()
+            X = range(self.reference_shape[0])
+        if Y is None and request.get('X') is not None:
+            Y = X
+        rows = [self.executor.submit(_matrix_row, x, Y, options) for x in X]
+        return {'matrix': [row.result() for row in rows]}
+
+    def knn(self, request):
+        self._require_reference()
+        options = resolve_options(self.options, request)
+        n_reference = self.reference_shape[0]
+        k = min(int(request.get('k', 1)), n_reference)
+
+        # A few chunks per worker keep the pool busy when the series lengths differ.
+        bounds = np.linspace(0, n_reference, min(n_reference, 4 * self.n_workers) + 1).astype(int)
+        chunks = [self.executor.submit(_reference_distances, request['x'], start, stop, options)
+                  for start, stop in zip(bounds[:-1], bounds[1:])]
+        distances = np.concatenate([chunk.result() for chunk in chunks])
+
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+        return {'indices': nearest.tolist(), 'distances': distances[nearest].tolist()}
+
+    def health(self):
+        return {'status': 'ok', 'workers': self.n_workers, 'reference': self.reference_shape}
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class DTWRequestHandler(BaseHTTPRequestHandler):
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, self.server.service.health())
+        else:
+            self._send(404, {'error': 'Unknown endpoint {}'.format(self.path)})
+
+    def do_POST(self):
+        endpoints = {'/distance': self.server.service.distance,
+                     '/matrix': self.server.service.matrix,
+                     '/knn': self.server.service.knn}
+        if self.path not in endpoints:
+            self._send(404, {'error': 'Unknown endpoint {}'.format(self.path)})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            response = endpoints[self.path](request)
+        except RequestError as error:
+            self._send(400, {'error': str(error)})
+            return
+        except (ValueError, KeyError, TypeError) as error:
+            # json.JSONDecodeError is a ValueError.
+            self.log_error('%s %s: %s', self.path, type(error).__name__, error)
+            self._send(400, {'error': 'Invalid request.'})
+            return
+        except Exception as error:
+            self.log_error('%s %s: %s', self.path, type(error).__name__, error)
+            self._send(500, {'error': 'Internal server error.'})
+            return
+        self._send(200, response)
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address.
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+
+class DTWHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class DTWUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(input_obj, host='127.0.0.1', port=8765, socket_path=None, reference=None, data_dir=None):
+    """
+    Run the DTW service until interrupted.
+
+    Parameters
+    ------------
+    :param input_obj: object with the default DTW parameters and n_threads (pool size)
+    :param host: address of the HTTP server
+    :param port: port of the HTTP server
+    :param socket_path: path of a Unix socket to listen on instead of TCP
+    :param reference: optional .npy file (N x T x F) used by /matrix and /knn
+    :param data_dir: optional directory whose .npy/.csv files can be given as series
+    """
+    service = DTWService(input_obj, reference, data_dir)
+    # Start the workers (and their warm-up) before accepting requests.
+    for started in [service.executor.submit(int) for _ in range(service.n_workers)]:
+        started.result()
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = DTWUnixServer(socket_path, DTWRequestHandler)
+        address = socket_path
+    else:
+        server = DTWHTTPServer((host, port), DTWRequestHandler)
+        address = 'http://{}:{}'.format(*server.server_address[:2])
+    server.service = service
+
+    # Stop cleanly on SIGTERM as well as on Ctrl-C.
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+    sys.stderr.write('dtwParallel serving on {} with {} workers\n'.format(address, service.n_workers))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -7,6 +7,7 @@ import os.path
 import sys
 from scipy.spatial import distance
 from error_control import possible_distances
+from ragged import load_tensor
 
 DTW_DESC_MSG = \
 """
@@ -27,7 +28,25 @@ DTW_DESC_MSG = \
         -s or --sigma_value: Sigma value for the applied exponential kernel transformation (float)
         -imx or --itakura_max_slope: Maximum slope for the Itakura parallelogram (float or None)
         -scr or --sakoe_chiba_radius: Radius to be used for Sakoe-Chiba band (int or None)
+        -dt or --dtype: Floating point precision of the computation, float64 or float32 (str)
+        -sr or --schedule_report: Report the worker utilization of a distance matrix on stderr (bool)
+
+    Batch mode:
+        batch [JOBS]: read pair jobs (JSON lines {"id", "x", "y"} or CSV lines x_path,y_path[,id])
+                      from JOBS or standard input and write one JSON result per line
+
+    Server mode:
+        serve [--host HOST] [-p PORT] [--socket PATH] [-r REFERENCE.npy] [--data_dir DIR]: local HTTP
+                      service answering POST /distance, /matrix and /knn with JSON
     
+    Distributed mode:
+        coordinate X [Y] --tiles DIR [--host HOST] [-p PORT] [--authkey_file FILE] [--tile_size N]
+                      [--retries N] [--tile_timeout SECONDS] [--local_workers N]: serve the tiles
+                      of the DTW matrix to the workers and assemble them (-of True -nf FILE)
+        worker [--host HOST] [-p PORT] [--authkey_file FILE]: compute tiles of a coordinator with -n processes
+        The key shared by the coordinator and the workers (--authkey, --authkey_file or the
+        DTWPARALLEL_AUTHKEY variable) is required: whoever knows it can run code on them.
+
     Optional arguments:
         -h, --help            show this help message and exit
         -v, --version         show version
@@ -52,7 +71,8 @@ def read_data(fname):
     
 
 def read_npy(fname):
-    return np.load(fname.name)
+    # .npy tensor (N x T x F) or .npz ragged tensor (values and offsets).
+    return load_tensor(fname.name)
 
 
 class Input:
@@ -89,9 +109,11 @@ class Input:
         self.sigma_kernel = config.getint('DEFAULT', 'sigma_kernel')
         self.itakura_max_slope = config.get('DEFAULT', 'itakura_max_slope')
         self.sakoe_chiba_radius = config.get('DEFAULT', 'sakoe_chiba_radius')
+        self.dtype = config.get('DEFAULT', 'dtype')
+        self.schedule_report = config.getboolean('DEFAULT', 'schedule_report')
 
 
-def parse_args(is_entry_file):
+def parse_args(is_entry_file, command=None):
     input_obj = Input()
 
     parser = argparse.ArgumentParser(usage=DTW_USAGE_MSG,
@@ -100,7 +122,87 @@ def parse_args(is_entry_file):
                              add_help=False)
 
     # Control input arguments by terminal
-    if is_entry_file:
+    if command == 'batch':
+        parser.add_argument('command', choices=['batch'],
+                            help='Compute the DTW distance of many pairs in one process.')
+
+        parser.add_argument('jobs', nargs='?', default='-',
+                            type=argparse.FileType('r'),
+                            help='File with one job per line (JSON or CSV of paths). Standard input if omitted or "-".')
+
+    elif command == 'serve':
+        parser.add_argument('command', choices=['serve'],
+                            help='Run a local DTW service.')
+
+        parser.add_argument('--host', default='127.0.0.1', type=str,
+                            help='Address to listen on.')
+
+        parser.add_argument('-p', '--port', default=8765, type=int,
+                            help='TCP port to listen on.')
+
+        parser.add_argument('--socket', default=None, type=str,
+                            help='Listen on this Unix socket instead of TCP.')
+
+        parser.add_argument('-r', '--reference', default=None, type=str,
+                            help='.npy file (N x T x F) kept in memory for matrix and k-NN requests.')
+
+        parser.add_argument('--data_dir', default=None, type=str,
+                            help='Directory whose .npy/.csv files can be given as series in the requests.')
+
+    elif command == 'coordinate':
+        parser.add_argument('command', choices=['coordinate'],
+                            help='Coordinate the distributed computation of a DTW matrix.')
+
+        parser.add_argument('X', type=str,
+                            help='.npy or .npz tensor, on a path readable by every worker.')
+
+        parser.add_argument('Y', nargs='?', default=None, type=str,
+                            help='Second tensor (X if omitted).')
+
+        parser.add_argument('--tiles', required=True, type=str,
+                            help='Directory of the tiles, shared with the workers.')
+
+        parser.add_argument('--host', default='127.0.0.1', type=str,
+                            help='Address to listen on (0.0.0.0 for all the interfaces, only on a trusted network).')
+
+        parser.add_argument('-p', '--port', default=8766, type=int,
+                            help='TCP port to listen on.')
+
+        parser.add_argument('--authkey', default=None, type=str,
+                            help='Key shared by the coordinator and the workers (visible in the process list: prefer --authkey_file or DTWPARALLEL_AUTHKEY).')
+
+        parser.add_argument('--authkey_file', default=None, type=str,
+                            help='File whose first line is the key shared by the coordinator and the workers.')
+
+        parser.add_argument('--tile_size', default=1024, type=int,
+                            help='Rows and columns of a tile.')
+
+        parser.add_argument('--retries', default=3, type=int,
+                            help='Retries of a failed tile before the computation is aborted.')
+
+        parser.add_argument('--tile_timeout', default=600, type=float,
+                            help='Seconds without news of a tile before it is given to another worker.')
+
+        parser.add_argument('--local_workers', default=0, type=int,
+                            help='Worker processes started on this host.')
+
+    elif command == 'worker':
+        parser.add_argument('command', choices=['worker'],
+                            help='Compute tiles of a distributed DTW matrix.')
+
+        parser.add_argument('--host', default='127.0.0.1', type=str,
+                            help='Address of the coordinator.')
+
+        parser.add_argument('-p', '--port', default=8766, type=int,
+                            help='TCP port of the coordinator.')
+
+        parser.add_argument('--authkey', default=None, type=str,
+                            help='Key shared by the coordinator and the workers (visible in the process list: prefer --authkey_file or DTWPARALLEL_AUTHKEY).')
+
+        parser.add_argument('--authkey_file', default=None, type=str,
+                            help='File whose first line is the key shared by the coordinator and the workers.')
+
+    elif is_entry_file:
 
         parser.add_argument('X',
                             type=argparse.FileType('r'),
@@ -162,6 +264,12 @@ def parse_args(is_entry_file):
                     help="Radius to be used for Sakoe-Chiba band. If None and select “sakoe_chiba”, a radius of 1 is used.")
     
 
+    parser.add_argument("-dt", "--dtype", nargs='?', default=input_obj.dtype, type=str, choices=["float64", "float32"],
+                    help="Floating point precision of the series, cost matrices and output. float32 halves memory and bandwidth.")
+
+    parser.add_argument("-sr", "--schedule_report", nargs='?', default=input_obj.schedule_report, type=bool,
+                    help="Write the worker utilization achieved while computing a distance matrix to stderr.")
+
     parser.add_argument('-h', '--help', action='help',
                     help=argparse.SUPPRESS)
 
@@ -188,6 +296,8 @@ def parse_args(is_entry_file):
     input_obj.n_threads = args.n_threads
     input_obj.dtw_to_kernel = args.dtw_to_kernel
     input_obj.sigma_kernel = args.sigma_kernel
+    input_obj.dtype = args.dtype
+    input_obj.schedule_report = args.schedule_report
 
     if args.itakura_max_slope == "None":
         input_obj.itakura_max_slope = None
@@ -209,7 +319,7 @@ def parse_args(is_entry_file):
             raise ValueError('Distance introduced not allowed or incorrect.')
          
     if not input_obj.local_dissimilarity in ["gower", "norm1", "norm2", "square_euclidean_distance"]:
-       input_obj.local_dissimilarity = eval("distance." + input_obj.local_dissimilarity)
+       input_obj.local_dissimilarity = getattr(distance, input_obj.local_dissimilarity)
 
 
     return parser.parse_args(), input_obj
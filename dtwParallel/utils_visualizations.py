@@ -1,15 +1,25 @@
+import warnings
+
 import matplotlib.pyplot as plt
 import seaborn as sbn
 import numpy as np
+from matplotlib.collections import LineCollection
 from numba import njit
 
 # Functions that allow to visualize the cost matrix together with 
 # the path followed to obtain the DTW distance value. In addition, 
 # a new function has been implemented to visualize the alignment 
 # between time series. 
+#
+# Cost matrices larger than ANNOTATED_MAX_SIZE per side are not drawn cell by cell: they
+# are pooled by blocks to at most POOLED_MAX_SIZE per side and shown as an image, and the
+# path and the alignment lines are drawn as line collections.
+
+ANNOTATED_MAX_SIZE = 50
+POOLED_MAX_SIZE = 1000
 
 
-@njit()
+@njit(cache=True)
 def get_path(cost_matrix):
     """
     Function that allows to obtain the path, that is, the route to reach the DTW distance value.
@@ -44,35 +54,76 @@ def get_path(cost_matrix):
     return path[::-1][1:]
 
 
- 
-def plot_cost_matrix(warp_path, cost):
+def pool_matrix(matrix, max_size=POOLED_MAX_SIZE, reduce="min"):
     """
-    Function to paint the cost matrix.
+    Function that reduces a matrix to at most max_size x max_size by pooling blocks of
+    cells (block-min, block-max or block-mean).
 
     Parameters
     ------------
-    :param warp_path: list
+    :param matrix: numpy.ndarray
+    :param max_size: maximum number of rows and columns of the result
+    :param reduce: "min", "max" or "mean"
+
+    :return: (numpy.ndarray, int, int)
+        Pooled matrix and number of rows and columns per block
+    """
+    reducers = {"min": np.nanmin, "max": np.nanmax, "mean": np.nanmean}
+    if reduce not in reducers:
+        raise ValueError('reduce must be one of {}.'.format(list(reducers)))
+
+    matrix = np.asarray(matrix, dtype=float)
+    rows, cols = matrix.shape
+    block_rows = -(-rows // max_size)
+    block_cols = -(-cols // max_size)
+    if block_rows == 1 and block_cols == 1:
+        return matrix, 1, 1
+
+    # Pad with NaN (ignored by the reduction) up to whole blocks.
+    padded = np.full((-(-rows // block_rows) * block_rows, -(-cols // block_cols) * block_cols), np.nan)
+    padded[:rows, :cols] = matrix
+    blocks = padded.reshape(padded.shape[0] // block_rows, block_rows, padded.shape[1] // block_cols, block_cols)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return reducers[reduce](blocks, axis=(1, 3)), block_rows, block_cols
+
+
+def plot_cost_matrix(warp_path, cost, reduce="min", max_size=POOLED_MAX_SIZE):
+    """
+    Function to paint the cost matrix. Matrices of up to ANNOTATED_MAX_SIZE rows and
+    columns are drawn as an annotated heatmap; larger ones are pooled by blocks
+    (see pool_matrix) and drawn as an image.
+
+    Parameters
+    ------------
+    :param warp_path: list or array of (i, j) as returned by get_path
     :param cost: numpy.ndarray
+    :param reduce: pooling of large matrices: "min", "max" or "mean"
+    :param max_size: maximum size of the pooled image
 
     :return: non return
     """
     fig, ax = plt.subplots(figsize=(12, 10))
-    sbn.set(font_scale=2)
-    sbn.heatmap(cost[1:, 1:], annot=True, square=True, linewidths=0.25, cmap="YlGnBu", ax=ax, annot_kws={
-        'fontsize': 20,
-        'fontweight': 'bold',
-        'fontfamily': 'serif'
-    })
-
-    # Get the warp path in x and y directions
-    path_x = [p[1] for p in warp_path]
-    path_y = [p[0] for p in warp_path]
+    # Centers of the cells of cost[1:, 1:] for the path (1-based indices).
+    path = np.asarray(warp_path, dtype=float).reshape(-1, 2) - 1
 
-    # Align the path from the center of each cell
-    path_xx = [x - 0.5 for x in path_x]
-    path_yy = [y - 0.5 for y in path_y]
+    if max(cost.shape) - 1 <= ANNOTATED_MAX_SIZE:
+        sbn.set(font_scale=2)
+        sbn.heatmap(cost[1:, 1:], annot=True, square=True, linewidths=0.25, cmap="YlGnBu", ax=ax, annot_kws={
+            'fontsize': 20,
+            'fontweight': 'bold',
+            'fontfamily': 'serif'
+        })
+        # Heatmap cells are centred at k + 0.5.
+        path += 0.5
+    else:
+        rows, cols = cost.shape[0] - 1, cost.shape[1] - 1
+        pooled, _, _ = pool_matrix(np.where(np.isfinite(cost[1:, 1:]), cost[1:, 1:], np.nan), max_size, reduce)
+        image = ax.imshow(pooled, cmap="YlGnBu", interpolation="nearest", aspect="auto",
+                          extent=(-0.5, cols - 0.5, rows - 0.5, -0.5))
+        fig.colorbar(image, ax=ax)
 
-    ax.plot(path_xx, path_yy, color='green', linewidth=4.5, alpha=0.6)
+    ax.add_collection(LineCollection([path[:, ::-1]], colors='green', linewidths=4.5, alpha=0.6))
 
 
 
@@ -84,7 +135,7 @@ def plot_alignment(x, y, warp_path):
     ------------
     :param x: list
     :param y: list
-    :param warp_path: list
+    :param warp_path: list or array of (i, j) as returned by get_path
 
     :return: non return
     """
@@ -95,21 +146,20 @@ def plot_alignment(x, y, warp_path):
     fig.patch.set_visible(False)
     ax.axis('off')
 
-    x_ref = np.copy(x)  
+    x_ref = np.array(x, dtype=float).ravel()
+    y = np.asarray(y, dtype=float).ravel()
     # Offset for visualization
-    x_ref += 2 * np.max(x)
+    x_ref += 2 * np.max(x_ref)
 
     xref = np.arange(len(x_ref))
 
     plt.plot(xref, x_ref, color="green", lw=linewidths[0], label="Time series 1")
     plt.plot(y, color="blue", lw=linewidths[1], label="Time series 2")
 
-    for i in range(len(warp_path)):
-        plt.plot(
-            [warp_path[i][0]-1, warp_path[i][1]-1],
-            [x_ref[warp_path[i][0]-1], y[warp_path[i][1]-1]],
-            color="k",
-            lw=linewidths[2],
-        )
+    # One line per aligned pair, all of them in a single collection.
+    path = np.asarray(warp_path, dtype=np.int64).reshape(-1, 2) - 1
+    segments = np.stack((np.column_stack((path[:, 0], x_ref[path[:, 0]])),
+                         np.column_stack((path[:, 1], y[path[:, 1]]))), axis=1)
+    ax.add_collection(LineCollection(segments, colors="k", linewidths=linewidths[2]))
 
-    plt.legend(fontsize=20)
\ No newline at end of file
+    plt.legend(fontsize=20)
@@ -0,0 +1,311 @@
+import sys
+import os.path
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from numba import njit
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from dtw_functions import (LOCAL_DISSIMILARITY_CODE, constraint_row_bounds, norm1, norm2,
+                           series_lengths, square_euclidean_distance, to_time_series, _dtw_rolling_rows)
+from scheduling import CHUNKS_PER_WORKER, balanced_chunks, paired_costs
+
+# Optimal warping path without the O(len(ts1) * len(ts2)) cost matrix (Hirschberg's
+# divide and conquer). The rows of a sub-problem are split in two halves; a forward pass
+# over the upper half and a backward pass over the lower half, each keeping a single row,
+# give the cost of the best path through every column of the boundary between them. The
+# column where the optimal path crosses splits the problem in two smaller ones. Sub-problems
+# of at most max_cells cells are solved directly with their cost matrix and a traceback.
+#
+# Memory is O(len(ts2) + max_cells) and time about twice that of the distance alone.
+
+MAX_PATH_CELLS = 2 ** 20
+
+
+@njit(cache=True, nogil=True)
+def _row_costs(dissimilarity_code, s1, ts2, lo, hi, j0, out):
+    # Local costs of the cells lo <= j < hi of a row, stored at out[j - j0].
+    if dissimilarity_code == 0:
+        for j in range(lo, hi):
+            out[j - j0] = norm1(s1, ts2[j])
+    elif dissimilarity_code == 1:
+        for j in range(lo, hi):
+            out[j - j0] = norm2(s1, ts2[j])
+    else:
+        for j in range(lo, hi):
+            out[j - j0] = square_euclidean_distance(s1, ts2[j])
+
+
+@njit(cache=True, nogil=True)
+def _forward_costs(dissimilarity_code, ts1, ts2, i0, i1, j0, j1, row_lo, row_hi):
+    """
+    Cost of the best path from (i0, j0) to each cell (i1 - 1, j), j0 <= j < j1.
+    """
+    width = j1 - j0
+    prev = np.full(width, np.inf, ts1.dtype)
+    cur = np.full(width, np.inf, ts1.dtype)
+    cost = np.empty(width, ts1.dtype)
+    for i in range(i0, i1):
+        lo, hi = max(row_lo[i], j0), min(row_hi[i], j1)
+        cur[:] = np.inf
+        _row_costs(dissimilarity_code, ts1[i], ts2, lo, hi, j0, cost)
+        for j in range(lo, hi):
+            k = j - j0
+            if i == i0 and k == 0:
+                best = 0.
+            elif k == 0:
+                best = prev[k]
+            else:
+                best = min(prev[k], cur[k - 1], prev[k - 1])
+            cur[k] = cost[k] + best
+        prev, cur = cur, prev
+    return prev
+
+
+@njit(cache=True, nogil=True)
+def _backward_costs(dissimilarity_code, ts1, ts2, i0, i1, j0, j1, row_lo, row_hi):
+    """
+    Cost of the best path from each cell (i0, j), j0 <= j < j1, to (i1 - 1, j1 - 1),
+    including the cost of the cell itself.
+    """
+    width = j1 - j0
+    prev = np.full(width, np.inf, ts1.dtype)
+    cur = np.full(width, np.inf, ts1.dtype)
+    cost = np.empty(width, ts1.dtype)
+    for i in range(i1 - 1, i0 - 1, -1):
+        lo, hi = max(row_lo[i], j0), min(row_hi[i], j1)
+        cur[:] = np.inf
+        _row_costs(dissimilarity_code, ts1[i], ts2, lo, hi, j0, cost)
+        for j in range(hi - 1, lo - 1, -1):
+            k = j - j0
+            if i == i1 - 1 and k == width - 1:
+                best = 0.
+            elif k == width - 1:
+                best = prev[k]
+            else:
+                best = min(prev[k], cur[k + 1], prev[k + 1])
+            cur[k] = cost[k] + best
+        prev, cur = cur, prev
+    return prev
+
+
+@njit(cache=True, nogil=True)
+def _subproblem_path(dissimilarity_code, ts1, ts2, i0, i1, j0, j1, row_lo, row_hi):
+    """
+    Optimal path from (i0, j0) to (i1 - 1, j1 - 1) with the cost matrix of the
+    sub-problem. Ties are resolved as in utils_visualizations.get_path: diagonal step
+    first, then ts1, then ts2.
+    """
+    height, width = i1 - i0, j1 - j0
+    cost_matrix = np.full((height + 1, width + 1), np.inf, ts1.dtype)
+    cost_matrix[0, 0] = 0.
+    cost = np.empty(width, ts1.dtype)
+    for i in range(i0, i1):
+        lo, hi = max(row_lo[i], j0), min(row_hi[i], j1)
+        _row_costs(dissimilarity_code, ts1[i], ts2, lo, hi, j0, cost)
+        for j in range(lo, hi):
+            r, c = i - i0 + 1, j - j0 + 1
+            cost_matrix[r, c] = cost[c - 1] + min(cost_matrix[r - 1, c], cost_matrix[r, c - 1], cost_matrix[r - 1, c - 1])
+
+    path = np.empty((height + width - 1, 2), np.int64)
+    r, c = height, width
+    n = 0
+    while True:
+        path[n, 0] = r - 1 + i0
+        path[n, 1] = c - 1 + j0
+        n += 1
+        if r == 1 and c == 1:
+            break
+        if r == 1:
+            c -= 1
+        elif c == 1:
+            r -= 1
+        else:
+            diagonal, up, left = cost_matrix[r - 1, c - 1], cost_matrix[r - 1, c], cost_matrix[r, c - 1]
+            if diagonal <= up and diagonal <= left:
+                r, c = r - 1, c - 1
+            elif up <= left:
+                r -= 1
+            else:
+                c -= 1
+    return path[:n][::-1]
+
+
+def dtw_path(ts1, ts2, local_dissimilarity="norm2", constrained_path_search=None, sakoe_chiba_radius=None,
+             itakura_max_slope=None, dtype="float64", max_cells=MAX_PATH_CELLS):
+    """
+    Dependent DTW distance and optimal warping path in linear memory.
+
+    Parameters
+    ------------
+    :param ts1: time serie 1
+    :param ts2: time serie 2
+    :param local_dissimilarity: "norm1", "norm2" or "square_euclidean_distance"
+    :param constrained_path_search: type constraint (None, sakoe-chiba o itakura)
+    :param sakoe_chiba_radius: int or None
+    :param itakura_max_slope: float or None
+    :param dtype: "float64" or "float32"
+    :param max_cells: sub-problems of at most this many cells are solved with their cost matrix
+
+    :return: (float, numpy.ndarray)
+        DTW distance and path (L x 2): path[k] = (index in ts1, index in ts2) of the
+        k-th aligned pair, from (0, 0) to (len(ts1) - 1, len(ts2) - 1). The path is
+        empty if the global constraint leaves no admissible path.
+    """
+    if local_dissimilarity not in LOCAL_DISSIMILARITY_CODE:
+        raise ValueError('dtw_path supports the local dissimilarities {}.'.format(list(LOCAL_DISSIMILARITY_CODE)))
+    code = LOCAL_DISSIMILARITY_CODE[local_dissimilarity]
+    ts1 = to_time_series(ts1, dtype)
+    ts2 = to_time_series(ts2, dtype)
+    len_ts1, len_ts2 = ts1.shape[0], ts2.shape[0]
+    row_lo, row_hi = constraint_row_bounds(len_ts1, len_ts2, constrained_path_search,
+                                           sakoe_chiba_radius, itakura_max_slope)
+
+    distance_value = ts1.dtype.type(_dtw_rolling_rows(code, row_lo, row_hi, ts1, ts2))
+    if not np.isfinite(distance_value):
+        return distance_value, np.empty((0, 2), dtype=np.int64)
+
+    pieces = []
+    # Sub-problems (i0, i1, j0, j1) from (i0, j0) to (i1 - 1, j1 - 1); the upper one is
+    # pushed last so the pieces come out in path order.
+    stack = [(0, len_ts1, 0, len_ts2)]
+    while stack:
+        i0, i1, j0, j1 = stack.pop()
+        if (i1 - i0) * (j1 - j0) <= max_cells or i1 - i0 == 1:
+            pieces.append(_subproblem_path(code, ts1, ts2, i0, i1, j0, j1, row_lo, row_hi))
+            continue
+
+        mid = (i0 + i1) // 2
+        forward = _forward_costs(code, ts1, ts2, i0, mid, j0, j1, row_lo, row_hi)
+        backward = _backward_costs(code, ts1, ts2, mid, i1, j0, j1, row_lo, row_hi)
+        # From (mid - 1, j) the path goes down to (mid, j) or diagonally to (mid, j + 1).
+        down = forward + backward
+        diagonal = np.full_like(down, np.inf)
+        diagonal[:-1] = forward[:-1] + backward[1:]
+        j = int(np.argmin(np.minimum(diagonal, down)))
+        k = j + 1 if diagonal[j] <= down[j] else j
+
+        stack.append((mid, i1, j0 + k, j1))
+        stack.append((i0, mid, j0, j0 + j + 1))
+
+    return distance_value, np.concatenate(pieces)
+
+
+class Alignments:
+    """
+    Distances and warping paths of many pairs of series, stored compactly: the int32
+    index pairs of all the paths one after another, and offsets[k]:offsets[k + 1] are the
+    rows of the path of pair k.
+
+    Attributes
+    ------------
+    pairs: (P x 2) indices of the series of each pair in X and Y
+    distances: (P) DTW distance of each pair
+    indices: (sum of path lengths x 2) int32 index pairs (index in x, index in y)
+    offsets: (P + 1) start of each path in indices
+    """
+    def __init__(self, pairs, distances, indices, offsets):
+        self.pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        self.distances = np.asarray(distances)
+        self.indices = np.asarray(indices, dtype=np.int32).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_paths(cls, pairs, distances, paths):
+        offsets = np.concatenate(([0], np.cumsum([len(path) for path in paths], dtype=np.int64)))
+        indices = np.concatenate(paths) if len(paths) else np.empty((0, 2), dtype=np.int32)
+        return cls(pairs, distances, indices, offsets)
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __getitem__(self, k):
+        """
+        Warping path (L x 2, int32) of pair k.
+        """
+        return self.indices[self.offsets[k]:self.offsets[k + 1]]
+
+    def save_npz(self, path):
+        np.savez_compressed(path, pairs=self.pairs, distances=self.distances,
+                            indices=self.indices, offsets=self.offsets)
+
+    @classmethod
+    def load_npz(cls, path):
+        with np.load(path) as data:
+            return cls(data['pairs'], data['distances'], data['indices'], data['offsets'])
+
+    def to_frame(self):
+        """
+        Long-format table with one row per aligned pair of time steps: pair, series_x,
+        series_y, distance, index_x, index_y.
+        """
+        pair = np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.offsets))
+        return pd.DataFrame({'pair': pair,
+                             'series_x': self.pairs[pair, 0],
+                             'series_y': self.pairs[pair, 1],
+                             'distance': self.distances[pair],
+                             'index_x': self.indices[:, 0],
+                             'index_y': self.indices[:, 1]})
+
+    def to_parquet(self, path):
+        # Requires a Parquet engine for pandas (pyarrow or fastparquet).
+        self.to_frame().to_parquet(path, index=False)
+
+
+def _dtw_path_chunk(pairs, options):
+    results = []
+    for ts1, ts2 in pairs:
+        distance_value, path = dtw_path(ts1, ts2, **options)
+        results.append((distance_value, path.astype(np.int32)))
+    return results
+
+
+def dtw_paths(X, Y=None, pairs=None, local_dissimilarity="norm2", constrained_path_search=None,
+              sakoe_chiba_radius=None, itakura_max_slope=None, n_threads=-1, dtype="float64",
+              max_cells=MAX_PATH_CELLS):
+    """
+    Distances and warping paths of many pairs of series, computed in parallel without
+    any plotting. The pairs are packed into chunks of similar cost (scheduling.py).
+
+    Parameters
+    ------------
+    :param X: tensor of N time series, list of series or RaggedTensor
+    :param Y: another set of series (X if None)
+    :param pairs: (P x 2) indices (i, j) of the pairs X[i], Y[j] (default: all of them)
+    :param local_dissimilarity: "norm1", "norm2" or "square_euclidean_distance"
+    :param constrained_path_search: type constraint (None, sakoe-chiba o itakura)
+    :param sakoe_chiba_radius: int or None
+    :param itakura_max_slope: float or None
+    :param n_threads: number of processes (joblib)
+    :param dtype: "float64" or "float32"
+    :param max_cells: see dtw_path
+
+    :return: Alignments
+    """
+    Y = X if Y is None else Y
+    if pairs is None:
+        pairs = np.stack(np.meshgrid(np.arange(len(X)), np.arange(len(Y)), indexing='ij'), axis=-1)
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+
+    options = dict(local_dissimilarity=local_dissimilarity, constrained_path_search=constrained_path_search,
+                   sakoe_chiba_radius=sakoe_chiba_radius, itakura_max_slope=itakura_max_slope,
+                   dtype=dtype, max_cells=max_cells)
+
+    costs = paired_costs(series_lengths(X)[pairs[:, 0]], series_lengths(Y)[pairs[:, 1]], constrained_path_search,
+                         sakoe_chiba_radius, itakura_max_slope)
+    chunks = balanced_chunks(costs, CHUNKS_PER_WORKER * effective_n_jobs(n_threads))
+
+    results = Parallel(n_jobs=n_threads, batch_size=1)(
+        delayed(_dtw_path_chunk)([(X[pairs[k, 0]], Y[pairs[k, 1]]) for k in chunk], options)
+        for chunk, _ in chunks
+    )
+
+    distances = np.empty(len(pairs), dtype=dtype)
+    paths = [None] * len(pairs)
+    for (chunk, _), chunk_results in zip(chunks, results):
+        for k, (distance_value, path) in zip(chunk, chunk_results):
+            distances[k] = distance_value
+            paths[k] = path
+    return Alignments.from_paths(pairs, distances, paths)
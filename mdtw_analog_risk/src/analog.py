@@ -3,9 +3,12 @@ from __future__ import annotations
 from typing import Dict, Tuple
 
 import numpy as np
-from joblib import Parallel, delayed
 
-from .dtw_backend import dtw_distance
+from .dtw_backend import dtw_distances
+
+
+def keep_count(total: int, keep_pct: float, max_keep: int) -> int:
+    return min(max(1, int(total * keep_pct)), max_keep)
 
 
 def prefilter_candidates(
@@ -15,8 +18,7 @@ def prefilter_candidates(
     max_keep: int,
 ) -> np.ndarray:
     distances = np.linalg.norm(candidate_stats - query_stats, axis=1)
-    total = len(distances)
-    keep_n = min(max(1, int(total * keep_pct)), max_keep)
+    keep_n = keep_count(len(distances), keep_pct, max_keep)
     keep_idx = np.argpartition(distances, keep_n - 1)[:keep_n]
     return keep_idx
 
@@ -32,11 +34,7 @@ def compute_topk_analogs(
     if len(candidate_indices) == 0:
         return np.array([]), np.array([])
 
-    distances = Parallel(n_jobs=n_jobs)(
-        delayed(dtw_distance)(query, candidates[idx], radius=radius, z_norm=True)
-        for idx in candidate_indices
-    )
-    distances = np.array(distances, dtype=float)
+    distances = dtw_distances(query, candidates[candidate_indices], radius=radius, z_norm=True, n_jobs=n_jobs)
     if len(distances) <= topk:
         order = np.argsort(distances)
     else:
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import time
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .evaluation import EventCluster, build_event_clusters, build_noncritical_clusters, score_clusters
+from .feature_engineering import compute_future_critical
+
+
+def _reference_future_critical(critical: pd.Series, tau: int) -> pd.Series:
+    values = critical.values
+    future_flag = np.zeros_like(values, dtype=int)
+    for idx in range(len(values)):
+        end = min(len(values), idx + tau + 1)
+        if idx + 1 < end:
+            future_flag[idx] = int(values[idx + 1:end].max() > 0)
+    return pd.Series(future_flag, index=critical.index, name=f"future_critical_{tau}")
+
+
+def _reference_event_clusters(labels: pd.Series) -> pd.DataFrame:
+    clusters = []
+    in_cluster = False
+    start = None
+    for date, flag in labels.items():
+        if flag and not in_cluster:
+            in_cluster = True
+            start = date
+        if in_cluster and not flag:
+            end = prev
+            clusters.append(EventCluster(start=start, end=end, length=(end - start).days + 1))
+            in_cluster = False
+        prev = date
+    if in_cluster:
+        clusters.append(EventCluster(start=start, end=prev, length=(prev - start).days + 1))
+    return pd.DataFrame([cluster.__dict__ for cluster in clusters])
+
+
+def _reference_score_clusters(clusters: pd.DataFrame, scores: pd.Series) -> pd.Series:
+    cluster_scores = []
+    for _, row in clusters.iterrows():
+        segment = scores.loc[row["start"]:row["end"]]
+        cluster_scores.append(segment.max())
+    return pd.Series(cluster_scores)
+
+
+def _best_time(func: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_synthetic_labels(n_days: int = 5200, critical_rate: float = 0.05, seed: int = 0) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range("2005-01-03", periods=n_days, name="date")
+    return pd.Series((rng.random(n_days) < critical_rate).astype(int), index=index)
+
+
+def make_synthetic_scores(index: pd.Index, nan_rate: float = 0.1, seed: int = 1) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    values = rng.random(len(index))
+    values[rng.random(len(index)) < nan_rate] = np.nan
+    return pd.Series(values, index=index)
+
+
+def run_benchmark(
+    n_days: int = 5200,
+    tau_list: Sequence[int] = (5, 20, 40, 60, 120),
+    repeat: int = 3,
+) -> pd.DataFrame:
+    """Check the vectorized label/cluster helpers against the loop implementations
+    they replaced and time both on synthetic daily data."""
+    labels = make_synthetic_labels(n_days)
+    scores = make_synthetic_scores(labels.index)
+    records: List[Dict[str, object]] = []
+
+    for tau in tau_list:
+        pd.testing.assert_series_equal(
+            compute_future_critical(labels, tau), _reference_future_critical(labels, tau)
+        )
+        records.append(
+            {
+                "stage": f"compute_future_critical(tau={tau})",
+                "reference_s": _best_time(lambda: _reference_future_critical(labels, tau), repeat),
+                "vectorized_s": _best_time(lambda: compute_future_critical(labels, tau), repeat),
+            }
+        )
+
+    for name, source in (("critical", labels), ("noncritical", (labels == 0).astype(int))):
+        clusters = build_event_clusters(source)
+        pd.testing.assert_frame_equal(clusters, _reference_event_clusters(source))
+        records.append(
+            {
+                "stage": f"build_event_clusters({name})",
+                "reference_s": _best_time(lambda: _reference_event_clusters(source), repeat),
+                "vectorized_s": _best_time(lambda: build_event_clusters(source), repeat),
+            }
+        )
+        pd.testing.assert_series_equal(
+            score_clusters(clusters, scores), _reference_score_clusters(clusters, scores)
+        )
+        records.append(
+            {
+                "stage": f"score_clusters({name})",
+                "reference_s": _best_time(lambda: _reference_score_clusters(clusters, scores), repeat),
+                "vectorized_s": _best_time(lambda: score_clusters(clusters, scores), repeat),
+            }
+        )
+
+    pd.testing.assert_frame_equal(
+        build_noncritical_clusters(labels), _reference_event_clusters((labels == 0).astype(int))
+    )
+
+    result = pd.DataFrame(records)
+    result["speedup"] = result["reference_s"] / result["vectorized_s"]
+    return result
+
+
+def main() -> None:
+    result = run_benchmark()
+    print(result.to_string(index=False, float_format=lambda value: f"{value:.6f}"))
+
+
+if __name__ == "__main__":
+    main()
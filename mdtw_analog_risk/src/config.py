@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 import yaml
 
@@ -11,6 +11,15 @@ import yaml
 class PrefilterConfig:
     keep_pct: float
     max_keep: int
+    method: str
+    lb_keogh: bool
+    recall_sample: int
+
+
+@dataclass
+class IncrementalConfig:
+    enabled: bool
+    previous_run: Optional[str]
 
 
 @dataclass
@@ -23,6 +32,8 @@ class PipelineConfig:
     dtw_radius: int
     only_noncritical_query: bool
     n_jobs: int
+    grid_jobs: int
+    incremental: IncrementalConfig
 
 
 @dataclass
@@ -30,6 +41,7 @@ class PathsConfig:
     root: Path
     data_dir: Path
     output_root: Path
+    cache_dir: Path
 
 
 def load_config(config_path: Path) -> PipelineConfig:
@@ -40,6 +52,16 @@ def load_config(config_path: Path) -> PipelineConfig:
     prefilter = PrefilterConfig(
         keep_pct=float(prefilter_payload.get("keep_pct", 0.03)),
         max_keep=int(prefilter_payload.get("max_keep", 800)),
+        method=str(prefilter_payload.get("method", "brute")),
+        lb_keogh=bool(prefilter_payload.get("lb_keogh", False)),
+        recall_sample=int(prefilter_payload.get("recall_sample", 0)),
+    )
+
+    incremental_payload = payload.get("incremental", {}) or {}
+    previous_run = incremental_payload.get("previous_run")
+    incremental = IncrementalConfig(
+        enabled=bool(incremental_payload.get("enabled", False)),
+        previous_run=str(previous_run) if previous_run else None,
     )
 
     return PipelineConfig(
@@ -51,6 +73,8 @@ def load_config(config_path: Path) -> PipelineConfig:
         dtw_radius=int(payload.get("dtw_radius", 10)),
         only_noncritical_query=bool(payload.get("only_noncritical_query", True)),
         n_jobs=int(payload.get("n_jobs", -1)),
+        grid_jobs=int(payload.get("grid_jobs", 0)),
+        incremental=incremental,
     )
 
 
@@ -59,4 +83,5 @@ def build_paths_config(project_root: Path) -> PathsConfig:
         root=project_root,
         data_dir=project_root / "data",
         output_root=project_root / "outputs",
+        cache_dir=project_root / "data" / ".cache",
     )
@@ -1,10 +1,16 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
 from pathlib import Path
-from typing import Tuple, List
+from typing import Any, Dict, Tuple, List
 
+import numpy as np
 import pandas as pd
 
+CACHE_FORMAT_VERSION = 1
+
 
 def _infer_date_column(frame: pd.DataFrame) -> str:
     candidates = [col for col in frame.columns if "date" in col.lower()]
@@ -51,6 +57,100 @@ def align_data(price: pd.DataFrame, factors: pd.DataFrame) -> Tuple[pd.DataFrame
     return price_aligned, factors_aligned
 
 
+def _file_fingerprint(path: Path, with_hash: bool = True) -> Dict[str, Any]:
+    stat = path.stat()
+    fingerprint: Dict[str, Any] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        digest = hashlib.sha256()
+        with path.open("rb") as handle:
+            for chunk in iter(lambda: handle.read(1 << 20), b""):
+                digest.update(chunk)
+        fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+
+def _cache_is_fresh(meta: Dict[str, Any], sources: Dict[str, Path]) -> Tuple[bool, bool]:
+    """Return (fresh, touched). A source is unchanged if size and mtime match, or
+    failing that (e.g. after a checkout that touched the file) if its content hash
+    still matches; `touched` reports that `meta` got the new mtimes."""
+    if meta.get("version") != CACHE_FORMAT_VERSION:
+        return False, False
+    touched = False
+    for name, path in sources.items():
+        cached = meta["sources"].get(name)
+        if cached is None or cached.get("path") != str(path.resolve()):
+            return False, False
+        current = _file_fingerprint(path, with_hash=False)
+        if current["size"] != cached["size"]:
+            return False, False
+        if current["mtime_ns"] != cached["mtime_ns"]:
+            if _file_fingerprint(path)["sha256"] != cached["sha256"]:
+                return False, False
+            cached["mtime_ns"] = current["mtime_ns"]
+            touched = True
+    return True, touched
+
+
+def _write_aligned_cache(
+    cache_dir: Path,
+    price: pd.DataFrame,
+    factors: pd.DataFrame,
+    sources: Dict[str, Path],
+) -> None:
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    values = np.column_stack([price["price"].to_numpy(dtype=float), factors.to_numpy(dtype=float)])
+    for name, array in (("values", values), ("dates", price.index.values)):
+        tmp_path = cache_dir / f"aligned_{name}.tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(array))
+        os.replace(tmp_path, cache_dir / f"aligned_{name}.npy")
+    meta = {
+        "version": CACHE_FORMAT_VERSION,
+        "factor_columns": [str(col) for col in factors.columns],
+        "sources": {
+            name: {"path": str(path.resolve()), **_file_fingerprint(path)} for name, path in sources.items()
+        },
+    }
+    _write_cache_meta(cache_dir, meta)
+
+
+def _write_cache_meta(cache_dir: Path, meta: Dict[str, Any]) -> None:
+    tmp_path = cache_dir / "aligned_meta.tmp.json"
+    tmp_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    os.replace(tmp_path, cache_dir / "aligned_meta.json")
+
+
+def load_aligned_data(
+    price_path: Path,
+    factor_path: Path,
+    cache_dir: Path,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Aligned price/factor frames, served from a `.npy` cache when the sources are unchanged.
+
+    The first call parses the Excel/CSV inputs, aligns them and stores the numeric
+    columns as one float64 matrix plus a date index. Later calls memory-map those
+    arrays, so the returned frames are read-only views without any parsing.
+    Only numeric factor columns are kept (see `validate_factor_columns`).
+    """
+    sources = {"price": price_path, "factors": factor_path}
+    meta_path = cache_dir / "aligned_meta.json"
+    meta = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.exists() else {}
+    fresh, touched = _cache_is_fresh(meta, sources) if meta else (False, False)
+
+    if not fresh:
+        price, factors = align_data(read_price_data(price_path), read_factor_data(factor_path))
+        factors = factors[validate_factor_columns(factors)]
+        _write_aligned_cache(cache_dir, price, factors, sources)
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    elif touched:
+        _write_cache_meta(cache_dir, meta)
+
+    values = np.load(cache_dir / "aligned_values.npy", mmap_mode="r")
+    index = pd.DatetimeIndex(np.load(cache_dir / "aligned_dates.npy"), name="date")
+    price = pd.DataFrame(values[:, :1], index=index, columns=["price"], copy=False)
+    factors = pd.DataFrame(values[:, 1:], index=index, columns=meta["factor_columns"], copy=False)
+    return price, factors
+
+
 def select_recent_rows(price: pd.DataFrame, factors: pd.DataFrame, n_rows: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
     if n_rows <= 0:
         return price, factors
@@ -5,6 +5,7 @@ from pathlib import Path
 from typing import Optional
 
 import numpy as np
+from joblib import Parallel, delayed
 
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
@@ -44,8 +45,37 @@ def dtw_distance(
     return float(distance)
 
 
+def dtw_distances(
+    query: np.ndarray,
+    candidates: np.ndarray,
+    radius: Optional[int] = None,
+    z_norm: bool = True,
+    n_jobs: int = 1,
+) -> np.ndarray:
+    """DTW distances between one query and a stack of candidates (N x T x F)."""
+    if not hasattr(dtw_functions, "dtw_one_to_many"):
+        distances = Parallel(n_jobs=n_jobs)(
+            delayed(dtw_distance)(query, candidate, radius=radius, z_norm=z_norm)
+            for candidate in candidates
+        )
+        return np.array(distances, dtype=float)
+    query_arr = np.asarray(query, dtype=float)
+    candidates_arr = np.asarray(candidates, dtype=float)
+    if z_norm:
+        query_arr = _z_norm_2d(query_arr)
+        candidates_arr = _z_norm_2d(candidates_arr)
+    return dtw_functions.dtw_one_to_many(
+        query_arr,
+        candidates_arr,
+        local_dissimilarity="norm2",
+        constrained_path_search="sakoe_chiba" if radius is not None else None,
+        sakoe_chiba_radius=radius,
+        n_threads=n_jobs,
+    )
+
+
 def _z_norm_2d(data: np.ndarray) -> np.ndarray:
-    mean = data.mean(axis=0, keepdims=True)
-    std = data.std(axis=0, keepdims=True)
+    mean = data.mean(axis=-2, keepdims=True)
+    std = data.std(axis=-2, keepdims=True)
     std = np.where(std == 0, 1.0, std)
     return (data - mean) / std
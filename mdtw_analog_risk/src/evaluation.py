@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from typing import Tuple
 
 import numpy as np
@@ -26,29 +26,37 @@ def compute_day_metrics(target: pd.Series, scores: pd.Series) -> Tuple[float, fl
 
 
 def build_event_clusters(labels: pd.Series) -> pd.DataFrame:
-    clusters = []
-    in_cluster = False
-    start = None
-    for date, flag in labels.items():
-        if flag and not in_cluster:
-            in_cluster = True
-            start = date
-        if in_cluster and not flag:
-            end = prev
-            clusters.append(EventCluster(start=start, end=end, length=(end - start).days + 1))
-            in_cluster = False
-        prev = date
-    if in_cluster:
-        clusters.append(EventCluster(start=start, end=prev, length=(prev - start).days + 1))
-    return pd.DataFrame([cluster.__dict__ for cluster in clusters])
+    flags = np.concatenate([[False], labels.values.astype(bool), [False]])
+    edges = np.diff(flags.astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    if len(starts) == 0:
+        return pd.DataFrame()
+    start = labels.index[starts]
+    end = labels.index[ends]
+    return pd.DataFrame(
+        {
+            "start": start,
+            "end": end,
+            "length": (end - start).days + 1,
+        },
+        columns=[field.name for field in fields(EventCluster)],
+    )
 
 
 def score_clusters(clusters: pd.DataFrame, scores: pd.Series) -> pd.Series:
-    cluster_scores = []
-    for _, row in clusters.iterrows():
-        segment = scores.loc[row["start"]:row["end"]]
-        cluster_scores.append(segment.max())
-    return pd.Series(cluster_scores)
+    # Each cluster maps to a positional slice of the (sorted) score index, so the
+    # per-cluster max is a single reduceat over [lo, hi) bounds; an extra -inf
+    # sentinel keeps hi == len(scores) a valid reduceat index.
+    if clusters.empty:
+        return pd.Series(dtype=float)
+    lo = scores.index.searchsorted(clusters["start"].values, side="left")
+    hi = scores.index.searchsorted(clusters["end"].values, side="right")
+    values = np.append(np.where(np.isnan(scores.values), -np.inf, scores.values), -np.inf)
+    bounds = np.column_stack([lo, hi]).ravel()
+    maxima = np.maximum.reduceat(values, bounds)[::2]
+    maxima = np.where((hi > lo) & np.isfinite(maxima), maxima, np.nan)
+    return pd.Series(maxima, dtype=float)
 
 
 def build_noncritical_clusters(labels: pd.Series) -> pd.DataFrame:
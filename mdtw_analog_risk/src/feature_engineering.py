@@ -18,10 +18,10 @@ def label_critical_days(returns: pd.Series, quantile: float = 0.05) -> pd.Series
 
 
 def compute_future_critical(critical: pd.Series, tau: int) -> pd.Series:
-    values = critical.values
-    future_flag = np.zeros_like(values, dtype=int)
-    for idx in range(len(values)):
-        end = min(len(values), idx + tau + 1)
-        if idx + 1 < end:
-            future_flag[idx] = int(values[idx + 1:end].max() > 0)
+    # Day idx is flagged when any of the days in (idx, idx + tau] is critical; a prefix
+    # count of critical days answers every window in O(1) instead of a slice max each.
+    counts = np.concatenate([[0], np.cumsum(critical.values > 0)])
+    idx = np.arange(len(critical))
+    end = np.clip(idx + tau + 1, idx + 1, len(critical))
+    future_flag = (counts[end] - counts[idx + 1] > 0).astype(int)
     return pd.Series(future_flag, index=critical.index, name=f"future_critical_{tau}")
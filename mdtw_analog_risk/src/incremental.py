@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+RISK_SCORES_FILE = "risk_scores.csv"
+ANALOG_TOPK_FILE = "analog_topk.csv"
+
+
+@dataclass
+class PreviousScores:
+    """Scores and cached top-k analogs of one (w, tau) configuration from an earlier run."""
+
+    scores: pd.Series
+    analogs: Dict[pd.Timestamp, pd.DataFrame]
+
+
+def find_previous_run(output_root: Path, previous_run: Optional[str]) -> Optional[Path]:
+    if previous_run:
+        run_dir = Path(previous_run)
+        if not run_dir.is_absolute():
+            run_dir = output_root / run_dir
+        if not (run_dir / RISK_SCORES_FILE).exists():
+            raise FileNotFoundError(f"No {RISK_SCORES_FILE} in previous run {run_dir}")
+        return run_dir
+    runs = sorted(path for path in output_root.glob("run_*") if (path / RISK_SCORES_FILE).exists())
+    return runs[-1] if runs else None
+
+
+def load_previous_run(run_dir: Path) -> Dict[Tuple[int, int], PreviousScores]:
+    risk = pd.read_csv(run_dir / RISK_SCORES_FILE, parse_dates=["date"])
+    topk_path = run_dir / ANALOG_TOPK_FILE
+    if topk_path.exists() and topk_path.stat().st_size > 0:
+        topk = pd.read_csv(topk_path, parse_dates=["date", "analog_date"])
+    else:
+        topk = pd.DataFrame(columns=["date", "w", "tau", "rank", "analog_date", "distance"])
+
+    previous: Dict[Tuple[int, int], PreviousScores] = {}
+    for (w, tau), group in risk.groupby(["w", "tau"]):
+        config_topk = topk[(topk["w"] == w) & (topk["tau"] == tau)]
+        previous[(int(w), int(tau))] = PreviousScores(
+            scores=group.set_index("date")["risk_score"],
+            analogs={date: rows.sort_values("rank") for date, rows in config_topk.groupby("date")},
+        )
+    return previous
+
+
+def reuse_score(
+    previous: PreviousScores,
+    date: pd.Timestamp,
+    future_critical: pd.Series,
+) -> Tuple[float, Optional[pd.DataFrame]]:
+    """Score an already-processed date from its cached analogs.
+
+    The analog labels are re-read from the current `future_critical` so that
+    relabelled history is picked up; the previous score is kept when none of the
+    cached analog dates is still in range.
+    """
+    analogs = previous.analogs.get(date)
+    if analogs is None or analogs.empty:
+        return float(previous.scores.loc[date]), None
+    labels = future_critical.reindex(analogs["analog_date"].values)
+    if labels.notna().any():
+        return float(labels.mean()), analogs
+    return float(previous.scores.loc[date]), analogs
+
+
+def topk_records(
+    date: pd.Timestamp,
+    w: int,
+    tau: int,
+    analog_dates: pd.Index,
+    distances: np.ndarray,
+) -> List[Dict[str, object]]:
+    return [
+        {
+            "date": date,
+            "w": w,
+            "tau": tau,
+            "rank": rank,
+            "analog_date": analog_date,
+            "distance": float(distance),
+        }
+        for rank, (analog_date, distance) in enumerate(zip(analog_dates, distances))
+    ]
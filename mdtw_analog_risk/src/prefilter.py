@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+from sklearn.neighbors import BallTree, KDTree
+
+from .analog import compute_topk_analogs, keep_count
+from .config import PrefilterConfig
+
+_TREE_TYPES = {"kdtree": KDTree, "balltree": BallTree}
+
+
+class StatsIndex:
+    """Exact nearest-neighbour search over `compute_window_stats` features.
+
+    Queries only ever see the candidate prefix ``[0, n_candidates)``, which grows as
+    the query date moves forward. For the tree methods the prefix is split into an
+    indexed head and a brute-force tail; the tree is rebuilt once the tail outgrows
+    ``rebuild_ratio`` of the head, so rebuilds stay logarithmic in the history size.
+    """
+
+    def __init__(
+        self,
+        stats: np.ndarray,
+        method: str = "brute",
+        leaf_size: int = 40,
+        rebuild_ratio: float = 0.125,
+    ) -> None:
+        if method != "brute" and method not in _TREE_TYPES:
+            raise ValueError(f"Unknown prefilter method: {method!r}")
+        self.stats = np.ascontiguousarray(stats, dtype=float)
+        self.method = method
+        self.leaf_size = leaf_size
+        self.rebuild_ratio = rebuild_ratio
+        self._tree = None
+        self._tree_size = 0
+
+    def _grow(self, n_candidates: int) -> None:
+        tail = n_candidates - self._tree_size
+        if tail > max(self.leaf_size, self.rebuild_ratio * self._tree_size):
+            self._tree = _TREE_TYPES[self.method](self.stats[:n_candidates], leaf_size=self.leaf_size)
+            self._tree_size = n_candidates
+
+    def query(self, query_stats: np.ndarray, n_candidates: int, keep_n: int) -> np.ndarray:
+        keep_n = min(keep_n, n_candidates)
+        if self.method != "brute":
+            self._grow(n_candidates)
+        head = self._tree_size if self._tree is not None and self._tree_size <= n_candidates else 0
+
+        indices = np.arange(head, n_candidates)
+        distances = np.linalg.norm(self.stats[head:n_candidates] - query_stats, axis=1)
+        if head:
+            tree_dist, tree_idx = self._tree.query(query_stats.reshape(1, -1), k=min(keep_n, head))
+            indices = np.concatenate([tree_idx[0], indices])
+            distances = np.concatenate([tree_dist[0], distances])
+
+        keep_idx = np.argpartition(distances, keep_n - 1)[:keep_n]
+        return indices[keep_idx]
+
+
+def _z_norm_windows(windows: np.ndarray) -> np.ndarray:
+    mean = windows.mean(axis=-2, keepdims=True)
+    std = windows.std(axis=-2, keepdims=True)
+    std = np.where(std == 0, 1.0, std)
+    return (windows - mean) / std
+
+
+def lb_keogh_prune(
+    query: np.ndarray,
+    candidates: np.ndarray,
+    candidate_indices: np.ndarray,
+    radius: Optional[int],
+    topk: int,
+) -> np.ndarray:
+    """Drop candidates that provably cannot enter the DTW top-k.
+
+    LB_Keogh against the (z-normalised) query envelope is a lower bound of the
+    Sakoe-Chiba DTW with Euclidean local cost, and the diagonal alignment is an
+    upper bound, so any candidate whose bound exceeds the k-th smallest upper bound
+    is discarded without changing the top-k.
+    """
+    if len(candidate_indices) <= topk:
+        return candidate_indices
+
+    query_norm = _z_norm_windows(np.asarray(query, dtype=float))
+    windows = _z_norm_windows(np.asarray(candidates[candidate_indices], dtype=float))
+    if radius is None:
+        upper = np.broadcast_to(query_norm.max(axis=0), query_norm.shape)
+        lower = np.broadcast_to(query_norm.min(axis=0), query_norm.shape)
+    else:
+        size = 2 * int(radius) + 1
+        upper = maximum_filter1d(query_norm, size=size, axis=0, mode="nearest")
+        lower = minimum_filter1d(query_norm, size=size, axis=0, mode="nearest")
+
+    excess = np.maximum(windows - upper, 0.0) + np.maximum(lower - windows, 0.0)
+    lower_bounds = np.sqrt((excess ** 2).sum(axis=2)).sum(axis=1)
+    upper_bounds = np.sqrt(((windows - query_norm) ** 2).sum(axis=2)).sum(axis=1)
+
+    threshold = np.partition(upper_bounds, topk - 1)[topk - 1]
+    return candidate_indices[lower_bounds <= threshold * (1 + 1e-9)]
+
+
+class CandidatePrefilter:
+    """Candidate selection ahead of the DTW top-k: a window-statistics index stage
+    followed by an optional LB_Keogh stage."""
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        window_stats: np.ndarray,
+        config: PrefilterConfig,
+        radius: Optional[int],
+        topk: int,
+    ) -> None:
+        self.matrix = matrix
+        self.window_stats = window_stats
+        self.config = config
+        self.radius = radius
+        self.topk = topk
+        self.index = StatsIndex(window_stats, method=config.method)
+
+    def select(self, query_idx: int, candidate_end: int) -> np.ndarray:
+        keep_n = keep_count(candidate_end, self.config.keep_pct, self.config.max_keep)
+        filtered_indices = self.index.query(self.window_stats[query_idx], candidate_end, keep_n)
+        if self.config.lb_keogh:
+            filtered_indices = lb_keogh_prune(
+                self.matrix[query_idx],
+                self.matrix,
+                filtered_indices,
+                radius=self.radius,
+                topk=self.topk,
+            )
+        return filtered_indices
+
+
+def prefilter_recall(
+    prefilter: CandidatePrefilter,
+    query_indices: Sequence[int],
+    tau: int,
+    n_jobs: int,
+) -> List[Dict[str, float]]:
+    """Recall of the prefiltered top-k against an exhaustive DTW scan of the same history."""
+    records: List[Dict[str, float]] = []
+    for idx in query_indices:
+        candidate_end = int(idx) - tau
+        if candidate_end <= 0:
+            continue
+        selected = prefilter.select(int(idx), candidate_end)
+        exhaustive_idx, _ = compute_topk_analogs(
+            prefilter.matrix[idx],
+            prefilter.matrix,
+            np.arange(0, candidate_end),
+            radius=prefilter.radius,
+            topk=prefilter.topk,
+            n_jobs=n_jobs,
+        )
+        filtered_idx, _ = compute_topk_analogs(
+            prefilter.matrix[idx],
+            prefilter.matrix,
+            selected,
+            radius=prefilter.radius,
+            topk=prefilter.topk,
+            n_jobs=n_jobs,
+        )
+        records.append(
+            {
+                "query_index": int(idx),
+                "candidates": candidate_end,
+                "prefiltered": int(len(selected)),
+                "recall": len(np.intersect1d(exhaustive_idx, filtered_idx)) / len(exhaustive_idx),
+            }
+        )
+    return records
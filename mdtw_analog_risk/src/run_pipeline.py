@@ -1,15 +1,16 @@
 from __future__ import annotations
 
-import csv
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 
-from .analog import build_risk_score, compute_topk_analogs, prefilter_candidates, summarize_prefilter
-from .config import build_paths_config, load_config
-from .data_io import align_data, read_factor_data, read_price_data, select_recent_rows, validate_factor_columns
+from .analog import build_risk_score, compute_topk_analogs, summarize_prefilter
+from .config import PipelineConfig, build_paths_config, load_config
+from .data_io import load_aligned_data, select_recent_rows, validate_factor_columns
 from .evaluation import (
     build_event_clusters,
     build_noncritical_clusters,
@@ -18,18 +19,172 @@ from .evaluation import (
     score_clusters,
 )
 from .feature_engineering import compute_delta, compute_future_critical, compute_returns, label_critical_days
+from .incremental import (
+    ANALOG_TOPK_FILE,
+    RISK_SCORES_FILE,
+    PreviousScores,
+    find_previous_run,
+    load_previous_run,
+    reuse_score,
+    topk_records,
+)
 from .plotting import plot_price, plot_risk_curve
+from .prefilter import CandidatePrefilter, prefilter_recall
+from .scheduler import BackgroundPlotter, CsvStream, run_grid, split_process_budget
 from .windowing import build_windows, compute_window_stats
 
 
+@dataclass
+class GridTask:
+    w: int
+    tau: int
+    factors: pd.DataFrame
+    critical: pd.Series
+    config: PipelineConfig
+    n_jobs: int
+    previous: Optional[PreviousScores] = None
+
+
+@dataclass
+class GridResult:
+    risk_records: List[Dict[str, Any]]
+    eval_day_record: Dict[str, Any]
+    eval_event_record: Dict[str, Any]
+    debug_record: Dict[str, Any]
+    recall_records: List[Dict[str, Any]]
+    topk_records: List[Dict[str, Any]]
+    clusters: pd.DataFrame
+    risk_scores: pd.Series
+    future_critical: pd.Series
+
+
+def run_configuration(task: GridTask) -> Optional[GridResult]:
+    w, tau, config = task.w, task.tau, task.config
+    critical = task.critical
+
+    windowed = build_windows(task.factors, w)
+    if windowed.matrix.size == 0:
+        return None
+    window_stats = compute_window_stats(windowed.matrix)
+    critical_window = critical.loc[windowed.index]
+
+    future_critical_all = compute_future_critical(critical, tau)
+    future_critical = future_critical_all.loc[windowed.index]
+    risk_scores = pd.Series(index=windowed.index, dtype=float)
+    non_null_mask = np.zeros(len(windowed.index), dtype=bool)
+    prefilter = CandidatePrefilter(
+        windowed.matrix,
+        window_stats,
+        config.prefilter,
+        radius=config.dtw_radius,
+        topk=config.topk,
+    )
+    analog_records: List[Dict[str, Any]] = []
+    previous = task.previous
+
+    for idx in range(len(windowed.index)):
+        date = windowed.index[idx]
+        if previous is not None and date in previous.scores.index:
+            risk_scores.iloc[idx], analogs = reuse_score(previous, date, future_critical_all)
+            non_null_mask[idx] = not np.isnan(risk_scores.iloc[idx])
+            if analogs is not None:
+                analog_records.extend(analogs.to_dict("records"))
+            continue
+        if config.only_noncritical_query and critical_window.iloc[idx] == 1:
+            risk_scores.iloc[idx] = np.nan
+            continue
+        candidate_end = idx - tau
+        if candidate_end <= 0:
+            risk_scores.iloc[idx] = np.nan
+            continue
+        filtered_indices = prefilter.select(idx, candidate_end)
+
+        top_idx, top_dist = compute_topk_analogs(
+            windowed.matrix[idx],
+            windowed.matrix,
+            filtered_indices,
+            radius=config.dtw_radius,
+            topk=config.topk,
+            n_jobs=task.n_jobs,
+        )
+        risk_scores.iloc[idx] = build_risk_score(top_idx, future_critical.values)
+        non_null_mask[idx] = not np.isnan(risk_scores.iloc[idx])
+        analog_records.extend(topk_records(date, w, tau, windowed.index[top_idx], top_dist))
+
+    risk_records = [
+        {
+            "date": date,
+            "w": w,
+            "tau": tau,
+            "risk_score": score,
+            "future_critical": future_critical.loc[date],
+        }
+        for date, score in risk_scores.items()
+    ]
+
+    auc, pr_auc = compute_day_metrics(future_critical, risk_scores)
+    eval_day_record = {
+        "w": w,
+        "tau": tau,
+        "auc": auc,
+        "pr_auc": pr_auc,
+        "count": int(future_critical.notna().sum()),
+        "non_null_risk": int(risk_scores.notna().sum()),
+    }
+
+    clusters = build_event_clusters(critical_window)
+    noncritical_clusters = build_noncritical_clusters(critical_window)
+    event_scores = score_clusters(clusters, risk_scores) if not clusters.empty else pd.Series(dtype=float)
+    non_event_scores = (
+        score_clusters(noncritical_clusters, risk_scores)
+        if not noncritical_clusters.empty
+        else pd.Series(dtype=float)
+    )
+    event_auc, event_pr_auc = compute_event_metrics(event_scores, non_event_scores)
+    eval_event_record = {
+        "w": w,
+        "tau": tau,
+        "event_auc": event_auc,
+        "event_pr_auc": event_pr_auc,
+        "event_count": int(len(event_scores)),
+        "non_event_count": int(len(non_event_scores)),
+    }
+
+    debug_record = summarize_prefilter(non_null_mask)
+    debug_record.update({"w": w, "tau": tau})
+
+    recall_records = []
+    if config.prefilter.recall_sample > 0:
+        rng = np.random.default_rng(0)
+        sample_size = min(config.prefilter.recall_sample, len(windowed.index))
+        sample = np.sort(rng.choice(len(windowed.index), size=sample_size, replace=False))
+        for record in prefilter_recall(prefilter, sample, tau, task.n_jobs):
+            record.update({"w": w, "tau": tau})
+            recall_records.append(record)
+
+    return GridResult(
+        risk_records=risk_records,
+        eval_day_record=eval_day_record,
+        eval_event_record=eval_event_record,
+        debug_record=debug_record,
+        recall_records=recall_records,
+        topk_records=analog_records,
+        clusters=clusters,
+        risk_scores=risk_scores,
+        future_critical=future_critical,
+    )
+
+
 def main() -> None:
     project_root = Path(__file__).resolve().parents[1]
     paths = build_paths_config(project_root)
     config = load_config(project_root / "config.yaml")
 
-    price = read_price_data(paths.data_dir / "result_with_original_prices.xlsx")
-    factors = read_factor_data(paths.data_dir / "13个指标变量数据.csv")
-    price, factors = align_data(price, factors)
+    price, factors = load_aligned_data(
+        paths.data_dir / "result_with_original_prices.xlsx",
+        paths.data_dir / "13个指标变量数据.csv",
+        paths.cache_dir,
+    )
     price, factors = select_recent_rows(price, factors, config.recent_n_rows)
 
     factor_cols = validate_factor_columns(factors)
@@ -48,115 +203,63 @@ def main() -> None:
     price_output["returns"] = returns
     price_output["critical"] = critical
 
-    plot_price(price["price"], critical, output_dir)
+    plotter = BackgroundPlotter()
+    plotter.submit(plot_price, price["price"], critical, output_dir)
 
-    risk_records = []
-    eval_day_records = []
-    eval_event_records = []
-    debug_records = []
+    previous_runs: Dict[Tuple[int, int], PreviousScores] = {}
+    if config.incremental.enabled:
+        previous_dir = find_previous_run(paths.output_root, config.incremental.previous_run)
+        if previous_dir is not None and previous_dir != output_dir:
+            previous_runs = load_previous_run(previous_dir)
 
-    for w in config.w_list:
-        windowed = build_windows(factors, w)
-        if windowed.matrix.size == 0:
-            continue
-        window_stats = compute_window_stats(windowed.matrix)
-        critical_window = critical.loc[windowed.index]
-
-        for tau in config.tau_list:
-            future_critical = compute_future_critical(critical, tau).loc[windowed.index]
-            risk_scores = pd.Series(index=windowed.index, dtype=float)
-            non_null_mask = np.zeros(len(windowed.index), dtype=bool)
-
-            for idx in range(len(windowed.index)):
-                if config.only_noncritical_query and critical_window.iloc[idx] == 1:
-                    risk_scores.iloc[idx] = np.nan
-                    continue
-                candidate_end = idx - tau
-                if candidate_end <= 0:
-                    risk_scores.iloc[idx] = np.nan
-                    continue
-                candidate_indices = np.arange(0, candidate_end)
-                if candidate_indices.size == 0:
-                    risk_scores.iloc[idx] = np.nan
-                    continue
-
-                keep_idx = prefilter_candidates(
-                    window_stats[idx],
-                    window_stats[candidate_indices],
-                    config.prefilter.keep_pct,
-                    config.prefilter.max_keep,
-                )
-                filtered_indices = candidate_indices[keep_idx]
-
-                top_idx, _ = compute_topk_analogs(
-                    windowed.matrix[idx],
-                    windowed.matrix,
-                    filtered_indices,
-                    radius=config.dtw_radius,
-                    topk=config.topk,
-                    n_jobs=config.n_jobs,
-                )
-                risk_scores.iloc[idx] = build_risk_score(top_idx, future_critical.values)
-                non_null_mask[idx] = not np.isnan(risk_scores.iloc[idx])
-
-            for date, score in risk_scores.items():
-                risk_records.append(
-                    {
-                        "date": date,
-                        "w": w,
-                        "tau": tau,
-                        "risk_score": score,
-                        "future_critical": future_critical.loc[date],
-                    }
-                )
-
-            auc, pr_auc = compute_day_metrics(future_critical, risk_scores)
-            eval_day_records.append(
-                {
-                    "w": w,
-                    "tau": tau,
-                    "auc": auc,
-                    "pr_auc": pr_auc,
-                    "count": int(future_critical.notna().sum()),
-                    "non_null_risk": int(risk_scores.notna().sum()),
-                }
-            )
-
-            clusters = build_event_clusters(critical_window)
-            noncritical_clusters = build_noncritical_clusters(critical_window)
-            event_scores = score_clusters(clusters, risk_scores) if not clusters.empty else pd.Series(dtype=float)
-            non_event_scores = (
-                score_clusters(noncritical_clusters, risk_scores)
-                if not noncritical_clusters.empty
-                else pd.Series(dtype=float)
-            )
-            event_auc, event_pr_auc = compute_event_metrics(event_scores, non_event_scores)
-            eval_event_records.append(
-                {
-                    "w": w,
-                    "tau": tau,
-                    "event_auc": event_auc,
-                    "event_pr_auc": event_pr_auc,
-                    "event_count": int(len(event_scores)),
-                    "non_event_count": int(len(non_event_scores)),
-                }
-            )
-
-            debug_info = summarize_prefilter(non_null_mask)
-            debug_info.update({"w": w, "tau": tau})
-            debug_records.append(debug_info)
-
-            if not clusters.empty:
-                clusters.to_csv(output_dir / "critical_clusters_for_eval.csv", index=False)
-
-            plot_risk_curve(risk_scores, future_critical, output_dir, w, tau)
-
-    risk_df = pd.DataFrame(risk_records)
-    risk_df.to_csv(output_dir / "risk_scores.csv", index=False, quoting=csv.QUOTE_MINIMAL)
-
-    pd.DataFrame(eval_day_records).to_csv(output_dir / "eval_day_level.csv", index=False)
-    pd.DataFrame(eval_event_records).to_csv(output_dir / "eval_event_level.csv", index=False)
-    pd.DataFrame(debug_records).to_csv(output_dir / "debug_non_null_rate.csv", index=False)
+    grid = [(w, tau) for w in config.w_list for tau in config.tau_list]
+    grid_jobs, dtw_jobs = split_process_budget(config.n_jobs, config.grid_jobs, len(grid))
+    tasks = [
+        GridTask(
+            w=w,
+            tau=tau,
+            factors=factors,
+            critical=critical,
+            config=config,
+            n_jobs=dtw_jobs,
+            previous=previous_runs.get((w, tau)),
+        )
+        for w, tau in grid
+    ]
+
+    risk_stream = CsvStream(output_dir / RISK_SCORES_FILE)
+    topk_stream = CsvStream(output_dir / ANALOG_TOPK_FILE)
+    eval_day_stream = CsvStream(output_dir / "eval_day_level.csv")
+    eval_event_stream = CsvStream(output_dir / "eval_event_level.csv")
+    debug_stream = CsvStream(output_dir / "debug_non_null_rate.csv")
+    recall_stream = CsvStream(output_dir / "debug_prefilter_recall.csv")
+    streams = (risk_stream, topk_stream, eval_day_stream, eval_event_stream, debug_stream, recall_stream)
+    clusters_position = -1
+
+    try:
+        for position, result in run_grid(run_configuration, tasks, grid_jobs):
+            if result is None:
+                continue
+            w, tau = grid[position]
+            risk_stream.write(result.risk_records)
+            topk_stream.write(result.topk_records)
+            eval_day_stream.write([result.eval_day_record])
+            eval_event_stream.write([result.eval_event_record])
+            debug_stream.write([result.debug_record])
+            recall_stream.write(result.recall_records)
+
+            # Serial runs kept the clusters of the last configuration in grid order.
+            if not result.clusters.empty and position > clusters_position:
+                result.clusters.to_csv(output_dir / "critical_clusters_for_eval.csv", index=False)
+                clusters_position = position
+
+            plotter.submit(plot_risk_curve, result.risk_scores, result.future_critical, output_dir, w, tau)
+    finally:
+        try:
+            plotter.close()
+        finally:
+            for stream in streams:
+                stream.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import multiprocessing as mp
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple, TypeVar
+
+import pandas as pd
+from joblib import effective_n_jobs, parallel_config
+
+TaskT = TypeVar("TaskT")
+ResultT = TypeVar("ResultT")
+
+# Loky workers spawned inside a grid worker otherwise stay alive for 300 s after their
+# last task, and the grid worker cannot exit before they do.
+_NESTED_IDLE_TIMEOUT = 5
+
+
+def split_process_budget(n_jobs: int, grid_jobs: int, n_tasks: int) -> Tuple[int, int]:
+    """Split a total process budget into (grid-level, DTW-level) parallelism.
+
+    `n_jobs` follows joblib semantics (-1 = all cores). `grid_jobs <= 0` picks one
+    grid worker per task, up to the budget; DTW workers share what remains.
+    """
+    total = effective_n_jobs(n_jobs)
+    if grid_jobs <= 0:
+        grid_jobs = total
+    grid_jobs = max(1, min(grid_jobs, n_tasks, total))
+    return grid_jobs, max(1, total // grid_jobs)
+
+
+def _run_nested(func: Callable[[TaskT], ResultT], task: TaskT) -> ResultT:
+    with parallel_config(backend="loky", idle_worker_timeout=_NESTED_IDLE_TIMEOUT):
+        return func(task)
+
+
+def run_grid(
+    func: Callable[[TaskT], ResultT],
+    tasks: Sequence[TaskT],
+    grid_jobs: int,
+) -> Iterator[Tuple[int, ResultT]]:
+    """Run independent tasks and yield (position, result) pairs as they finish."""
+    if grid_jobs <= 1:
+        for position, task in enumerate(tasks):
+            yield position, func(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=grid_jobs, mp_context=mp.get_context("spawn")) as executor:
+        futures: Dict[Future, int] = {
+            executor.submit(_run_nested, func, task): position for position, task in enumerate(tasks)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+class CsvStream:
+    """Append record batches to a CSV file as they become available."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._written = False
+
+    def write(self, records: Iterable[Dict[str, Any]]) -> None:
+        frame = pd.DataFrame(list(records))
+        if frame.empty:
+            return
+        frame.to_csv(self.path, mode="a" if self._written else "w", header=not self._written, index=False)
+        self._written = True
+
+    def close(self) -> None:
+        if not self._written:
+            self.path.touch()
+
+
+class BackgroundPlotter:
+    """Single background process that renders figures while the grid runs.
+
+    Matplotlib state is not shared with the pipeline process, so one dedicated
+    worker keeps rendering off the critical path without thread-safety concerns.
+    """
+
+    def __init__(self) -> None:
+        self._executor = ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn"))
+        self._pending: List[Future] = []
+
+    def submit(self, func: Callable[..., None], *args: Any) -> None:
+        self._pending.append(self._executor.submit(func, *args))
+
+    def close(self) -> None:
+        try:
+            for future in self._pending:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)